@@ -4,12 +4,20 @@ import logging
 import json
 import websockets
 import asyncio
+from ..common.admin import AdminServer, IndexedDict, paginate
+from ..common.exchange import verify_resume_token, make_packet_id, packet_epoch, parse_packet_id
+from ..common.transport import CONNECTION_CLOSED, WebSocketTransport
+from .scheduler import UplinkScheduler
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class MSCConnection(threading.Thread):
+    RECONNECT_MIN_DELAY = 0.1
+    RECONNECT_MAX_DELAY = 5.0
+    UPLINK_BATCH = 64  # Most packets sent to the MSC per tick
+
     def __init__(self, outgoing_queue, user_queues, msc_url, base_message_station):
         super().__init__(daemon=True)
         self.outgoing_queue = outgoing_queue
@@ -27,6 +35,8 @@ class MSCConnection(threading.Thread):
 
         if message_type == "bms_register_response":
             logging.info(f"Received BMS registration response: {message}")
+            # Cache the key used to validate resume tokens locally
+            self.base_message_station.resume_key = message.get("resume_key")
 
         elif message_type == "challenge":
             user_id = message.get("user_id")
@@ -35,9 +45,24 @@ class MSCConnection(threading.Thread):
             else:
                 logging.warning(f"No queue for user_id: {user_id}")
 
+        elif message_type == "kick":
+            user_id = message.get("user_id")
+            if not self.base_message_station.kick_user(user_id):
+                logging.warning(f"No queue for kicked user_id: {user_id}")
+
+        elif message_type == "drain":
+            self.base_message_station.drain(message.get("server_url"))
+
+        elif message_type == "location_invalidate":
+            # The MSC has seen this user attach elsewhere
+            self.base_message_station.local_subscribers.discard(message.get("user_id"))
+
         elif message_type in {"auth_result", "logout_result", "text"}:
             target_user = message.get("user_id") or message.get("target_user")
             if target_user in self.user_queues:
+                if message_type == "auth_result" and message.get("status") == "Authenticated":
+                    # Only users still connected here; a user who left keeps no entry
+                    self.base_message_station.local_subscribers.add(target_user)
                 self.user_queues[target_user].put(message)
             else:
                 logging.warning(f"No queue for target_user: {target_user}")
@@ -58,12 +83,22 @@ class MSCConnection(threading.Thread):
     async def handle_outgoing_messages(self, websocket):
         while self.running:
             try:
-                if not self.outgoing_queue.empty():
+                for _ in range(self.UPLINK_BATCH):
+                    if self.outgoing_queue.empty():
+                        break
                     message = self.outgoing_queue.get()
                     message["bms_id"] = self.base_message_station.bms_id
-                    await websocket.send(json.dumps(message))
+                    try:
+                        await websocket.send(json.dumps(message))
+                    except CONNECTION_CLOSED:
+                        # Keep the message for the next MSC connection
+                        self.outgoing_queue.put(message)
+                        raise
                     logging.info(f"Sent to MSC: {message}")
                 await asyncio.sleep(0.1)  # Prevent tight looping
+            except CONNECTION_CLOSED:
+                logging.warning("MSC connection closed while sending.")
+                break
             except Exception as e:
                 logging.error(f"Error in outgoing message handler: {e}")
 
@@ -79,20 +114,38 @@ class MSCConnection(threading.Thread):
                 break
 
     async def connect_to_msc(self):
-        async with websockets.connect(self.msc_url) as websocket:
+        async with self.base_message_station.transport.connect(self.msc_url) as websocket:
             logging.info("Connected to MSC.")
             
             # Send BMS registration
             await self.send_bms_register(websocket)
 
-            # Run incoming and outgoing handlers concurrently
-            await asyncio.gather(
-                self.handle_outgoing_messages(websocket),
-                self.handle_incoming_messages(websocket)
-            )
+            # Run incoming and outgoing handlers until either one stops
+            tasks = [
+                asyncio.create_task(self.handle_outgoing_messages(websocket)),
+                asyncio.create_task(self.handle_incoming_messages(websocket))
+            ]
+            _, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in pending:
+                task.cancel()
+
+    async def maintain_msc_connection(self):
+        """Keep a link to the MSC, reconnecting with backoff when it drops."""
+        delay = self.RECONNECT_MIN_DELAY
+        while self.running:
+            try:
+                await self.connect_to_msc()
+                delay = self.RECONNECT_MIN_DELAY
+            except (OSError, websockets.WebSocketException) as e:
+                logging.error(f"Could not connect to MSC: {e}")
+            if not self.running:
+                break
+            logging.info(f"Reconnecting to MSC in {delay:.1f}s")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.RECONNECT_MAX_DELAY)
 
     def run(self):
-        asyncio.run(self.connect_to_msc())
+        asyncio.run(self.maintain_msc_connection())
 
 class UserStationConnection(threading.Thread):
     def __init__(self, websocket, user_id, outgoing_queue, msc_outgoing_queue, base_message_station):
@@ -111,6 +164,9 @@ class UserStationConnection(threading.Thread):
 
         message_type = message["type"]
 
+        if not self.base_message_station.valid_packet_origin(message, self.user_id):
+            return
+
         if message_type == "auth_response":
             message["bms_id"] = self.base_message_station.bms_id
             self.msc_outgoing_queue.put(message)
@@ -123,7 +179,8 @@ class UserStationConnection(threading.Thread):
         elif message_type == "text":
             message["source_user"] = self.user_id
             message["bms_id"] = self.base_message_station.bms_id
-            self.msc_outgoing_queue.put(message)
+            if not self.base_message_station.switch_locally(message):
+                self.msc_outgoing_queue.put(message)
 
         else:
             logger.warning(f"Unhandled message type from User Station: {message_type}")
@@ -134,6 +191,10 @@ class UserStationConnection(threading.Thread):
                 message = self.outgoing_queue.get()
                 await self.websocket.send(json.dumps(message))
                 logger.info(f"Sent to User Station {self.user_id}: {message}")
+                if message.get("type") in {"kick", "handover"}:
+                    # The user has been told to go away, so end the session
+                    self.running = False
+                    await self.websocket.close()
             await asyncio.sleep(0.1)  # Add a small sleep to yield control and avoid busy waiting
 
     async def receive_incoming_messages(self):
@@ -143,7 +204,7 @@ class UserStationConnection(threading.Thread):
                 message = json.loads(incoming)
                 logger.info(f"Received from User Station {self.user_id}: {message}")
                 self.process_message(message)
-            except websockets.ConnectionClosed:
+            except CONNECTION_CLOSED:
                 logger.info(f"User Station {self.user_id} disconnected unexpectedly.")
                 self.running = False
             except Exception as e:
@@ -163,6 +224,7 @@ class UserStationConnection(threading.Thread):
         finally:
             self.running = False
             self.websocket.close()
+            self.base_message_station.local_subscribers.discard(self.user_id)
             if self.user_id in self.base_message_station.user_queues:
                 del self.base_message_station.user_queues[self.user_id]
                 logger.info(f"Cleaned up resources for user {self.user_id}")
@@ -170,6 +232,7 @@ class UserStationConnection(threading.Thread):
                 logout_message = {
                     "type": "auth_logout",
                     "user_id": self.user_id,
+                    "reason": "disconnect",
                     "packet_id": self.base_message_station.generate_packet_id(),
                     "bms_id": self.base_message_station.bms_id
                 }
@@ -180,21 +243,89 @@ class UserStationConnection(threading.Thread):
         asyncio.run(self.handle_user_station())
 
 class BaseMessageStation:
-    def __init__(self, host, port, msc_url, bms_id):
+    def __init__(self, host, port, msc_url, bms_id, transport=None):
         self.host = host
         self.port = port
         self.msc_url = msc_url
         self.bms_id = bms_id
-        self.user_queues = {}
-        self.msc_outgoing_queue = queue.Queue()
+        self.transport = transport or WebSocketTransport()
+        self.user_queues = IndexedDict()
+        self.local_subscribers = set()  # Users the MSC has confirmed are attached here
+        self.msc_outgoing_queue = UplinkScheduler()
         self.msc_connection = MSCConnection(self.msc_outgoing_queue, self.user_queues, self.msc_url, self)
         self.running = True
+        self.draining = False
+        self.handover_url = None
+        self.resume_key = None  # Provided by the MSC on registration
+        self.packet_epoch = packet_epoch()
         self.packet_id_counter = 0  # Initialize packet ID counter
 
     def generate_packet_id(self):
-        """Generate a unique incrementing packet ID."""
+        """Generate a globally unique packet ID."""
         self.packet_id_counter += 1
-        return str(self.packet_id_counter)  # Ensure packet_id is a JSON string
+        return make_packet_id(self.bms_id, self.packet_epoch, self.packet_id_counter)
+
+    def drain(self, server_url=None):
+        """Stop accepting users and hand every connected user over to server_url."""
+        logger.info(f"Draining BMS {self.bms_id}, handing users over to {server_url}")
+        self.draining = True
+        self.handover_url = server_url
+        for user_id, user_queue in list(self.user_queues.items()):
+            user_queue.put({"type": "handover", "user_id": user_id, "server_url": server_url})
+
+    def kick_user(self, user_id):
+        """Disconnect a single user."""
+        user_queue = self.user_queues.get(user_id)
+        if user_queue is None:
+            return False
+        user_queue.put({"type": "kick", "user_id": user_id})
+        return True
+
+    def valid_packet_origin(self, message, user_id):
+        """Check a User Station only sends packet ids in its own name."""
+        parsed = parse_packet_id(message.get("packet_id"))
+        if parsed and parsed[0] != user_id:
+            logger.warning(f"Dropping packet from {user_id} with foreign packet_id {message.get('packet_id')}")
+            return False
+        return True
+
+    def switch_locally(self, message):
+        """Deliver a text directly when both users are attached to this BMS.
+
+        Only an accounting record goes to the MSC. Returns False if the
+        message has to be routed through the MSC.
+        """
+        source_user = message.get("source_user")
+        target_user = message.get("target_user")
+        if source_user not in self.local_subscribers or target_user not in self.local_subscribers:
+            return False
+        target_queue = self.user_queues.get(target_user)
+        if target_queue is None:
+            return False
+
+        target_queue.put({
+            "type": "text",
+            "source_user": source_user,
+            "target_user": target_user,
+            "message": message.get("message"),
+            "packet_id": message.get("packet_id")
+        })
+        self.msc_outgoing_queue.put({
+            "type": "text_record",
+            "source_user": source_user,
+            "target_user": target_user,
+            "length": len(message.get("message") or ""),
+            "packet_id": message.get("packet_id"),
+            "bms_id": self.bms_id
+        })
+        logger.info(f"Switched text locally from {source_user} to {target_user}")
+        return True
+
+    def verify_resume(self, message):
+        """Validate a resume token without a round trip to the MSC."""
+        if not self.resume_key:
+            return False
+        return verify_resume_token(message.get("token"), message.get("user_id"), self.resume_key)
 
     async def handle_new_user(self, websocket, path):
         try:
@@ -212,24 +343,62 @@ class BaseMessageStation:
 
                 message_type = message["type"]
 
-                if message_type == "auth":
+                if message_type in {"auth", "resume"}:
                     # Extract and validate user_id from the auth packet
                     user_id = message.get("user_id")
-                    if not user_id:
-                        logger.warning("Auth packet missing 'user_id'")
+                    if not isinstance(user_id, str) or not user_id:
+                        logger.warning(f"Auth packet with missing or invalid 'user_id': {user_id!r}")
+                        user_id = None
+                        continue
+
+                    if not self.valid_packet_origin(message, user_id):
+                        user_id = None
                         continue
 
                     if user_id in self.user_queues:
                         logger.warning(f"User ID {user_id} is already connected.")
                         break
 
+                    # Not local until this new session has authenticated
+                    self.local_subscribers.discard(user_id)
+
+                    if self.draining:
+                        logger.info(f"Refusing user {user_id} while draining.")
+                        await websocket.send(json.dumps({
+                            "type": "handover",
+                            "user_id": user_id,
+                            "server_url": self.handover_url
+                        }))
+                        user_id = None
+                        break
+
                     # Create a queue for this user and store it
                     user_outgoing_queue = queue.Queue()
                     self.user_queues[user_id] = user_outgoing_queue
 
-                    # Forward the auth packet to the MSC
-                    message["bms_id"] = self.bms_id
-                    self.msc_outgoing_queue.put(message)
+                    if message_type == "resume" and self.verify_resume(message):
+                        # Token is valid: authenticate locally and only notify the MSC
+                        self.local_subscribers.add(user_id)
+                        user_outgoing_queue.put({
+                            "type": "auth_result",
+                            "status": "Authenticated",
+                            "user_id": user_id,
+                            "packet_id": message.get("packet_id")
+                        })
+                        self.msc_outgoing_queue.put({
+                            "type": "attach",
+                            "user_id": user_id,
+                            "token": message.get("token"),
+                            "packet_id": message.get("packet_id"),
+                            "bms_id": self.bms_id
+                        })
+                    else:
+                        # Forward the auth packet to the MSC, a rejected resume
+                        # falls back to the full challenge exchange
+                        message["type"] = "auth"
+                        message.pop("token", None)
+                        message["bms_id"] = self.bms_id
+                        self.msc_outgoing_queue.put(message)
 
                     # Start a UserStationConnection for this user
                     user_connection = UserStationConnection(
@@ -246,29 +415,65 @@ class BaseMessageStation:
             while self.running:
                 await asyncio.sleep(1)
 
-        except websockets.ConnectionClosed:
+        except CONNECTION_CLOSED:
             logger.info(f"Connection closed for user: {user_id if user_id else 'unknown'}")
         finally:
             if user_id:
+                self.local_subscribers.discard(user_id)
                 self.user_queues.pop(user_id, None)
                 logger.info(f"User {user_id} disconnected.")
                 # Send auth_logout packet to MSC
                 logout_message = {
                     "type": "auth_logout",
                     "user_id": user_id,
+                    "reason": "disconnect",
                     "packet_id": self.generate_packet_id(),
                     "bms_id": self.bms_id
                 }
                 self.msc_outgoing_queue.put(logout_message)
                 logger.info(f"Sent auth_logout for user {user_id} to MSC")
 
-    async def start_server(self):
+    def admin_commands(self):
+        async def stats():
+            return {
+                "bms_id": self.bms_id,
+                "draining": self.draining,
+                "connected_users": len(self.user_queues),
+                "msc_outgoing_queue": self.msc_outgoing_queue.qsize()
+            }
+
+        async def list_users(after=None, limit=None):
+            return paginate(
+                self.user_queues, after, limit,
+                lambda user_id, user_queue: {"user_id": user_id, "queue_depth": user_queue.qsize()}
+            )
+
+        async def kick_user(user_id):
+            if not self.kick_user(user_id):
+                raise ValueError(f"Unknown user: {user_id}")
+            return {"user_id": user_id}
+
+        async def drain(server_url=None):
+            self.drain(server_url)
+            return {"bms_id": self.bms_id, "server_url": server_url}
+
+        return {"stats": stats, "list_users": list_users, "kick_user": kick_user, "drain": drain}
+
+    async def start_server(self, admin_socket=None):
         self.msc_connection.start()
 
-        async with websockets.serve(self.handle_new_user, self.host, self.port):
-            logging.info(f"BMS {self.bms_id} running on {self.host}:{self.port}")
-            await asyncio.Future()  # Keep server running
+        admin_server = AdminServer(admin_socket, self.admin_commands()) if admin_socket else None
+        if admin_server:
+            await admin_server.start()
+
+        try:
+            async with self.transport.serve(self.handle_new_user, self.host, self.port):
+                logging.info(f"BMS {self.bms_id} running on {self.host}:{self.port}")
+                await asyncio.Future()  # Keep server running
+        finally:
+            if admin_server:
+                await admin_server.close()
 
-def main(host: str, port: int, msc_url: str, bms_id: str):
+def main(host: str, port: int, msc_url: str, bms_id: str, admin_socket: str = None):
     bms = BaseMessageStation(host, port, msc_url, bms_id)
-    asyncio.run(bms.start_server())
+    asyncio.run(bms.start_server(admin_socket))
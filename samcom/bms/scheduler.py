@@ -0,0 +1,89 @@
+import threading
+import queue
+from collections import deque
+
+# Packets that keep sessions working and are always sent before user traffic
+CONTROL_TYPES = {"bms_register", "auth", "auth_response", "auth_logout", "attach"}
+
+
+class UplinkScheduler:
+    """Queue for the shared BMS -> MSC uplink.
+
+    Control packets are served first, in FIFO order. All other packets are
+    queued per user, and users take turns using deficit round-robin, so one
+    busy user cannot delay everyone else. put() and get() are O(1).
+
+    This is a drop-in replacement for queue.Queue (put, get, empty, qsize).
+    """
+
+    # Bytes of credit each user gets per round
+    QUANTUM = 1024
+
+    def __init__(self, quantum=QUANTUM):
+        self.quantum = quantum
+        self.control = deque()
+        self.flows = {}      # user_id -> deque of pending packets
+        self.deficits = {}   # user_id -> unused credit in bytes
+        self.active = deque()  # user_ids with pending packets, in round-robin order
+        self.size = 0
+        self.not_empty = threading.Condition(threading.Lock())
+
+    def cost(self, message):
+        """Approximate wire size of a packet, capped so one turn always sends a packet."""
+        return min(len(message.get("message") or "") + 64, self.quantum)
+
+    def put(self, message, block=True, timeout=None):
+        with self.not_empty:
+            if message.get("type") in CONTROL_TYPES:
+                self.control.append(message)
+            else:
+                user_id = message.get("source_user") or message.get("user_id") or ""
+                flow = self.flows.get(user_id)
+                if flow is None:
+                    flow = self.flows[user_id] = deque()
+                    self.deficits[user_id] = 0
+                    self.active.append(user_id)
+                flow.append(message)
+            self.size += 1
+            self.not_empty.notify()
+
+    def get(self, block=True, timeout=None):
+        with self.not_empty:
+            if not block:
+                if not self.size:
+                    raise queue.Empty
+            elif not self.not_empty.wait_for(lambda: self.size, timeout):
+                raise queue.Empty
+            self.size -= 1
+
+            if self.control:
+                return self.control.popleft()
+
+            while True:
+                user_id = self.active[0]
+                flow = self.flows[user_id]
+                cost = self.cost(flow[0])
+                if self.deficits[user_id] >= cost:
+                    self.deficits[user_id] -= cost
+                    message = flow.popleft()
+                    if not flow:
+                        # User is idle again, drop its state until it sends more
+                        self.active.popleft()
+                        del self.flows[user_id]
+                        del self.deficits[user_id]
+                    return message
+                # Turn over: move on and give the next user its quantum
+                self.active.rotate(-1)
+                self.deficits[self.active[0]] += self.quantum
+
+    def get_nowait(self):
+        return self.get(block=False)
+
+    def put_nowait(self, message):
+        self.put(message, block=False)
+
+    def empty(self):
+        return not self.size
+
+    def qsize(self):
+        return self.size
@@ -0,0 +1,212 @@
+import json
+import logging
+import os
+import threading
+from bisect import bisect_left, bisect_right
+
+import websockets
+
+logger = logging.getLogger(__name__)
+
+# Hard cap on the number of rows a single paged query may return, so that one
+# admin request can never hold the event loop for longer than a page takes.
+MAX_PAGE_SIZE = 1000
+DEFAULT_PAGE_SIZE = 100
+
+
+class SortedKeyIndex:
+    """ Sorted set of keys kept in blocks, so that inserts, removals and
+    "keys after this one" lookups cost O(log n + block size) at any size. """
+
+    BLOCK_SIZE = 512
+
+    def __init__(self):
+        self.blocks = []  # Sorted lists of keys, each at most 2 * BLOCK_SIZE long
+        self.maxes = []   # Last key of each block
+
+    def add(self, key):
+        if not self.blocks:
+            self.blocks.append([key])
+            self.maxes.append(key)
+            return
+        i = min(bisect_left(self.maxes, key), len(self.blocks) - 1)
+        block = self.blocks[i]
+        j = bisect_left(block, key)
+        if j < len(block) and block[j] == key:
+            return
+        block.insert(j, key)
+        self.maxes[i] = block[-1]
+        if len(block) > 2 * self.BLOCK_SIZE:
+            self.blocks[i:i + 1] = [block[:self.BLOCK_SIZE], block[self.BLOCK_SIZE:]]
+            self.maxes[i:i + 1] = [block[self.BLOCK_SIZE - 1], block[-1]]
+
+    def discard(self, key):
+        i = bisect_left(self.maxes, key)
+        if i == len(self.blocks):
+            return
+        block = self.blocks[i]
+        j = bisect_left(block, key)
+        if j == len(block) or block[j] != key:
+            return
+        del block[j]
+        if block:
+            self.maxes[i] = block[-1]
+        else:
+            del self.blocks[i]
+            del self.maxes[i]
+
+    def clear(self):
+        self.blocks.clear()
+        self.maxes.clear()
+
+    def after(self, key, limit):
+        """ Up to limit keys greater than key (or from the start if key is None). """
+        if key is None:
+            i, j = 0, 0
+        else:
+            i = bisect_right(self.maxes, key)
+            j = bisect_right(self.blocks[i], key) if i < len(self.blocks) else 0
+        keys = []
+        while i < len(self.blocks) and len(keys) < limit:
+            keys.extend(self.blocks[i][j:j + limit - len(keys)])
+            i, j = i + 1, 0
+        return keys
+
+
+class IndexedDict(dict):
+    """ dict of str keys that keeps a SortedKeyIndex of them for cursor paging.
+
+    Keys must be str so they can always be ordered against each other; any
+    other key is refused before either the dict or the index is touched.
+
+    Updates to the dict and its index happen under one lock, as the BMS
+    changes its user table from several threads.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__()
+        self.index = SortedKeyIndex()
+        self.lock = threading.RLock()
+        self.update(*args, **kwargs)
+
+    def __setitem__(self, key, value):
+        if not isinstance(key, str):
+            raise TypeError(f"IndexedDict keys must be str, not {type(key).__name__}")
+        with self.lock:
+            if key not in self:
+                self.index.add(key)
+            super().__setitem__(key, value)
+
+    def __delitem__(self, key):
+        with self.lock:
+            super().__delitem__(key)
+            self.index.discard(key)
+
+    def pop(self, key, *default):
+        with self.lock:
+            if key in self:
+                self.index.discard(key)
+            return super().pop(key, *default)
+
+    def popitem(self):
+        with self.lock:
+            key, value = super().popitem()
+            self.index.discard(key)
+            return key, value
+
+    def setdefault(self, key, default=None):
+        with self.lock:
+            if key not in self:
+                self[key] = default
+            return self[key]
+
+    def update(self, *args, **kwargs):
+        with self.lock:
+            for key, value in dict(*args, **kwargs).items():
+                self[key] = value
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+            self.index.clear()
+
+    def items_after(self, key, limit):
+        """ Up to limit (key, value) pairs following key, in key order. """
+        with self.lock:
+            return [(k, self[k]) for k in self.index.after(key, limit)]
+
+
+def paginate(mapping: IndexedDict, after=None, limit=DEFAULT_PAGE_SIZE, render=None):
+    """ Return the page of a mapping that follows the key `after`, in key order.
+
+    Pass the returned `next_cursor` as `after` to get the next page. Rows
+    present for the whole listing are returned exactly once even while the
+    table changes, and each page costs O(log n + limit).
+    """
+    limit = min(max(int(limit or DEFAULT_PAGE_SIZE), 1), MAX_PAGE_SIZE)
+    rows = mapping.items_after(after, limit)
+    items = [render(key, value) if render else key for key, value in rows]
+    next_cursor = rows[-1][0] if len(rows) == limit else None
+    return {
+        "items": items,
+        "next_cursor": next_cursor,
+        "total": len(mapping)
+    }
+
+
+class AdminServer:
+    """ Local admin endpoint speaking JSON over a Unix domain websocket. """
+
+    def __init__(self, socket_path, commands):
+        self.socket_path = socket_path
+        self.commands = commands
+        self.server = None
+
+    async def handle_request(self, request):
+        try:
+            command = json.loads(request)
+        except ValueError:
+            return {"status": "error", "error": "Invalid JSON"}
+        if not isinstance(command, dict):
+            return {"status": "error", "error": "Request must be a JSON object"}
+
+        name = command.pop("command", None)
+        handler = self.commands.get(name)
+        if handler is None:
+            return {"status": "error", "error": f"Unknown command: {name}"}
+
+        try:
+            result = await handler(**command)
+        except TypeError as e:
+            return {"status": "error", "error": f"Bad arguments for {name}: {e}"}
+        except Exception as e:
+            logger.error(f"Admin command {name} failed: {e}")
+            return {"status": "error", "error": str(e)}
+        return {"status": "ok", "command": name, "result": result}
+
+    async def handler(self, websocket, path=None):
+        try:
+            async for request in websocket:
+                response = await self.handle_request(request)
+                await websocket.send(json.dumps(response))
+        except websockets.exceptions.ConnectionClosed:
+            pass
+
+    async def start(self):
+        """ Start serving admin requests on the configured Unix socket. """
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # Remove a stale socket left by a previous run
+        self.server = await websockets.unix_serve(self.handler, self.socket_path)
+        os.chmod(self.socket_path, 0o600)  # Only our own user may kick users or drain
+        logger.info(f"Admin endpoint listening on {self.socket_path}")
+        return self.server
+
+    async def close(self):
+        """ Stop serving admin requests and remove the socket. """
+        if self.server is None:
+            return
+        self.server.close()
+        await self.server.wait_closed()
+        self.server = None
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)
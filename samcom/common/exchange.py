@@ -1,5 +1,46 @@
 import hmac
 import hashlib
+import time
 
 def generate_challenge(user_id: str, secret_key: str):
-    return hmac.new(secret_key.encode(), user_id.encode(), hashlib.sha256).hexdigest()
\ No newline at end of file
+    return hmac.new(secret_key.encode(), user_id.encode(), hashlib.sha256).hexdigest()
+
+def generate_resume_token(user_id: str, key: str, ttl: int, generation: int = 0):
+    """ Signed token letting user_id skip the challenge until it expires or is revoked. """
+    payload = f"{user_id}:{generation}:{int(time.time()) + ttl}"
+    signature = hmac.new(key.encode(), payload.encode(), hashlib.sha256).hexdigest()
+    return f"{payload}:{signature}"
+
+def verify_resume_token(token: str, user_id: str, key: str):
+    """ Check a resume token was signed with key for user_id and has not expired. """
+    try:
+        payload, signature = token.rsplit(":", 1)
+        token_user, _, expires = payload.rsplit(":", 2)
+        expires = int(expires)
+    except (AttributeError, ValueError):
+        return False
+    expected = hmac.new(key.encode(), payload.encode(), hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature) and token_user == user_id and expires > time.time()
+
+def resume_token_generation(token: str):
+    """ Revocation generation a resume token was issued for, or None if malformed. """
+    try:
+        return int(token.rsplit(":", 3)[1])
+    except (AttributeError, IndexError, ValueError):
+        return None
+
+def make_packet_id(origin: str, epoch: int, counter: int):
+    """ Globally unique packet id: the sender, when it started (ms) and its counter. """
+    return f"{origin}:{epoch}:{counter}"
+
+def parse_packet_id(packet_id):
+    """ Split a packet id into (origin, epoch, counter), or None for other formats. """
+    try:
+        origin, epoch, counter = packet_id.rsplit(":", 2)
+        return origin, int(epoch), int(counter)
+    except (AttributeError, ValueError):
+        return None
+
+def packet_epoch():
+    """ Epoch for a new packet counter, increasing across restarts of a sender. """
+    return int(time.time() * 1000)
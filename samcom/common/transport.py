@@ -0,0 +1,213 @@
+import asyncio
+import threading
+from collections import deque
+from urllib.parse import urlparse
+
+import websockets
+
+
+class ChannelClosed(Exception):
+    pass
+
+
+# Exceptions raised by any transport when the other end has gone away
+CONNECTION_CLOSED = (websockets.ConnectionClosed, ChannelClosed)
+
+
+class WebSocketTransport:
+    """ Real network transport, a thin wrapper around the websockets library. """
+
+    uses_sockets = True
+
+    def serve(self, handler, host=None, port=None, **kwargs):
+        return websockets.serve(handler, host, port, **kwargs)
+
+    def connect(self, url):
+        return websockets.connect(url)
+
+
+class MemoryChannel:
+    """ One end of an in-memory connection with the websocket send/recv API.
+
+    Ends may be used from different threads and event loops, which the BMS
+    and UserStation need as they run a loop per thread.
+    """
+
+    _CLOSE = object()
+
+    def __init__(self, remote_address):
+        self.remote_address = remote_address
+        self.peer: 'MemoryChannel' = None
+        self.inbox = deque()
+        self.lock = threading.Lock()
+        self.waiter = None
+        self.closed = False
+
+    def deliver(self, item):
+        with self.lock:
+            self.inbox.append(item)
+            waiter, self.waiter = self.waiter, None
+        if waiter is not None:
+            waiter.get_loop().call_soon_threadsafe(self._wake, waiter)
+
+    @staticmethod
+    def _wake(waiter):
+        if not waiter.done():
+            waiter.set_result(None)
+
+    async def send(self, message):
+        if self.closed:
+            raise ChannelClosed("Channel is closed")
+        if self.peer.closed:
+            # Like a websocket, so senders can keep the message for a new connection
+            raise ChannelClosed("Connection closed by peer")
+        self.peer.deliver(message)
+
+    async def recv(self):
+        while True:
+            with self.lock:
+                if self.inbox:
+                    item = self.inbox.popleft()
+                    break
+                if self.closed:
+                    raise ChannelClosed("Channel is closed")
+                self.waiter = asyncio.get_running_loop().create_future()
+                waiter = self.waiter
+            await waiter
+
+        if item is self._CLOSE:
+            self.closed = True
+            raise ChannelClosed("Connection closed by peer")
+        return item
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            self.peer.deliver(self._CLOSE)
+            self.deliver(self._CLOSE)  # Wake up our own pending recv()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return await self.recv()
+        except ChannelClosed:
+            raise StopAsyncIteration
+
+
+class MemoryServer:
+    """ Behaves like a websockets server: close() stops accepting and closes
+    every open connection, wait_closed() returns once their handlers are done.
+    """
+
+    def __init__(self, transport, url, handler, loop):
+        self.transport = transport
+        self.url = url
+        self.handler = handler
+        self.loop = loop
+        self.handlers = {}  # channel -> future of its running handler
+        self.lock = threading.Lock()  # Connections are accepted from any thread
+        self.closed = asyncio.Event()
+
+    def accept(self, channel, path):
+        future = asyncio.run_coroutine_threadsafe(self.handler(channel, path), self.loop)
+        with self.lock:
+            self.handlers[channel] = future
+        future.add_done_callback(lambda _: self.forget(channel))
+        return future
+
+    def forget(self, channel):
+        with self.lock:
+            self.handlers.pop(channel, None)
+
+    def close(self):
+        self.transport.servers.pop(self.url, None)
+        with self.lock:
+            channels = list(self.handlers)
+        for channel in channels:
+            self.loop.create_task(channel.close())
+        self.closed.set()
+
+    async def wait_closed(self):
+        await self.closed.wait()
+        with self.lock:
+            running = list(self.handlers.values())
+        if running:
+            await asyncio.wait([asyncio.wrap_future(future) for future in running])
+
+
+class _MemoryServe:
+    """ Awaitable / async context manager returned by MemoryTransport.serve. """
+
+    def __init__(self, transport, handler, url):
+        self.transport = transport
+        self.handler = handler
+        self.url = url
+        self.server = None
+
+    async def start(self):
+        self.server = MemoryServer(self.transport, self.url, self.handler, asyncio.get_running_loop())
+        self.transport.servers[self.url] = self.server
+        return self.server
+
+    def __await__(self):
+        return self.start().__await__()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        self.server.close()
+        await self.server.wait_closed()
+
+
+class _MemoryConnect:
+    """ Awaitable / async context manager returned by MemoryTransport.connect. """
+
+    def __init__(self, transport, url):
+        self.transport = transport
+        self.url = url
+        self.channel = None
+
+    async def open(self):
+        parsed = urlparse(self.url)
+        server = self.transport.servers.get(parsed.netloc)
+        if server is None:
+            raise ConnectionRefusedError(f"No in-memory server at {self.url}")
+        self.transport.connection_count += 1
+        client_end = MemoryChannel(server.url)
+        server_end = MemoryChannel(f"memory-client-{self.transport.connection_count}")
+        client_end.peer, server_end.peer = server_end, client_end
+        server.accept(server_end, parsed.path or "/")
+        self.channel = client_end
+        return client_end
+
+    def __await__(self):
+        return self.open().__await__()
+
+    async def __aenter__(self):
+        return await self.open()
+
+    async def __aexit__(self, *exc):
+        await self.channel.close()
+
+
+class MemoryTransport:
+    """ In-process transport made of paired channels, for network-free tests.
+
+    Share one instance between the MSC, BMSes and UserStations of a
+    simulated topology; servers are addressed by "ws://host:port" as usual.
+    """
+
+    uses_sockets = False
+
+    def __init__(self):
+        self.servers = {}
+        self.connection_count = 0
+
+    def serve(self, handler, host=None, port=None, **kwargs):
+        return _MemoryServe(self, handler, f"{host}:{port}")
+
+    def connect(self, url):
+        return _MemoryConnect(self, url)
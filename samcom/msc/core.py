@@ -1,14 +1,32 @@
 import logging
-import websockets
 import json
 import asyncio
 import hmac
-from ..common.exchange import generate_challenge
+import os
+import secrets
+import signal
+import socket
+import subprocess
+import sys
+import time
+from ..common.exchange import generate_challenge, generate_resume_token, resume_token_generation, verify_resume_token
+from ..common.admin import AdminServer, IndexedDict, paginate
+from ..common.transport import CONNECTION_CLOSED, WebSocketTransport
+from .dedup import DuplicateFilter
 
 # Configuring logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Environment variable used to hand the listening socket to a restarted MSC
+LISTEN_FD_ENV = "SAMCOM_MSC_LISTEN_FD"
+# Snapshots older than this (in seconds) are ignored on start-up
+SNAPSHOT_MAX_AGE = 60
+# Where main() keeps its snapshot, so a restarted MSC finds the previous state
+DEFAULT_SNAPSHOT_PATH = os.path.join(os.path.expanduser("~"), ".samcom", "msc-snapshot.json")
+# Lifetime (in seconds) of the resume tokens issued with auth_result
+RESUME_TOKEN_TTL = 3600
+
 # Class for managing users and authentication status
 class UserManager:
     def __init__(self):
@@ -18,6 +36,8 @@ class UserManager:
                 "secret_key": "secretkey123"
             }
         }
+        self.authenticated = IndexedDict()  # Sorted index of authenticated user_ids -> bms_id
+        self.resume_key = secrets.token_hex(32)  # Signs resume tokens, shared with registered BMSes
 
     def make_challenge(self, user_id):
         """ Generate a challenge for a user based on the secret key. """
@@ -26,7 +46,7 @@ class UserManager:
             return generate_challenge(user_id, secret_key)
         return None
 
-    def authenticate_user(self, user_id, response, secret_key):
+    def authenticate_user(self, user_id, response, secret_key, bms_id=None):
         """ Authenticate a user based on the challenge-response mechanism. """
         logger.info(f"Authenticating user: {user_id} with response: {response}")
         if user_id not in self.users:
@@ -36,27 +56,76 @@ class UserManager:
         expected_response = self.make_challenge(user_id)
         if hmac.compare_digest(expected_response, response):
             self.users[user_id]['authenticated'] = True
+            self.users[user_id]['bms_id'] = bms_id
+            self.authenticated[user_id] = bms_id
             return True
         return False
 
-    def logout_user(self, user_id):
-        """ Log out a user """
+    def issue_resume_token(self, user_id):
+        """ Issue a token the user can present to a BMS instead of a challenge response. """
+        generation = self.users[user_id].get('token_generation', 0)
+        return generate_resume_token(user_id, self.resume_key, RESUME_TOKEN_TTL, generation)
+
+    def revoke_resume_tokens(self, user_id):
+        """ Invalidate every resume token issued to a user so far. """
+        if user_id in self.users:
+            self.users[user_id]['token_generation'] = self.users[user_id].get('token_generation', 0) + 1
+
+    def attach_user(self, user_id, bms_id, token):
+        """ Mark a user authenticated on a BMS that presented their resume token. """
+        logger.info(f"Attaching resumed user: {user_id} on BMS: {bms_id}")
+        if user_id not in self.users:
+            return False
+        if not verify_resume_token(token, user_id, self.resume_key):
+            logger.info(f"Rejecting forged or expired resume token for {user_id}")
+            return False
+        if resume_token_generation(token) != self.users[user_id].get('token_generation', 0):
+            logger.info(f"Rejecting revoked resume token for {user_id}")
+            return False
+        self.users[user_id]['authenticated'] = True
+        self.users[user_id]['bms_id'] = bms_id
+        self.authenticated[user_id] = bms_id
+        return True
+
+    def logout_user(self, user_id, bms_id=None):
+        """ Log out a user, ignoring late logouts from a BMS the user has left """
         logger.info(f"Logging out user: {user_id}")
+        location = self.authenticated.get(user_id)
+        if bms_id is not None and location is not None and location != bms_id:
+            logger.info(f"Ignoring logout of {user_id} from {bms_id}, user is now on {location}")
+            return False
         if user_id in self.users:
             self.users[user_id]['authenticated'] = False
+            self.users[user_id]['bms_id'] = None
+            self.authenticated.pop(user_id, None)
             return True
         return False
 
+    def get_user_location(self, user_id):
+        """ Retrieve the BMS an authenticated user is attached to """
+        return self.authenticated.get(user_id)
+
     def get_user_status(self, user_id):
         """ Retrieve the authentication status of a user """
         if user_id in self.users:
             return self.users[user_id]['authenticated']
         return False
 
+    def snapshot(self):
+        """ Serialisable copy of the user table and location registry """
+        return {"users": self.users, "authenticated": self.authenticated, "resume_key": self.resume_key}
+
+    def restore(self, data):
+        """ Restore the user table and location registry from a snapshot """
+        self.users.update(data.get("users", {}))
+        self.authenticated.update(data.get("authenticated", {}))
+        self.resume_key = data.get("resume_key", self.resume_key)
+        logger.info(f"Restored {len(self.authenticated)} authenticated sessions")
+
 # Class for managing the BMS connections
 class BMSConnectionManager:
     def __init__(self):
-        self.bms_connections = {}
+        self.bms_connections = IndexedDict()
 
     def register_bms(self, bms_id, websocket):
         """ Register a BMS connection. """
@@ -78,6 +147,7 @@ class MessageRouter:
     def __init__(self, user_manager: UserManager, bms_manager: BMSConnectionManager):
         self.user_manager = user_manager
         self.bms_manager = bms_manager
+        self.duplicates = DuplicateFilter()
 
     async def handle_message(self, websocket, message):
         """ Handle incoming messages and route them accordingly. """
@@ -88,16 +158,25 @@ class MessageRouter:
 
             logger.info(f"Received message type: {msg_type} with packet_id: {packet_id}")
 
+            origins = {msg.get("source_user"), msg.get("user_id"), msg.get("bms_id")} - {None}
+            if self.duplicates.seen(packet_id, origins):
+                logger.info(f"Dropping duplicate packet: {packet_id}")
+                return
+
             if msg_type == "bms_register":
                 await self.process_bms_register(msg, websocket)
             elif msg_type == "auth":
                 await self.process_authentication(msg)
             elif msg_type == "auth_response":
                 await self.process_auth_response(msg)
+            elif msg_type == "attach":
+                await self.process_attach(msg)
             elif msg_type == "auth_logout":
                 await self.process_logout(msg)
             elif msg_type == "text":
                 await self.process_text_message(msg)
+            elif msg_type == "text_record":
+                await self.process_text_record(msg)
             else:
                 logger.error(f"Unknown message type: {msg_type}")
 
@@ -110,6 +189,16 @@ class MessageRouter:
         packet_id = msg.get("packet_id")
         
         logger.info(f"Processing BMS registration for BMS: {bms_id}")
+
+        if not isinstance(bms_id, str) or not bms_id:
+            logger.error(f"Rejecting BMS registration with invalid bms_id: {bms_id!r}")
+            await websocket.send(json.dumps({
+                "type": "bms_register_response",
+                "status": "Failed",
+                "bms_id": bms_id,
+                "packet_id": packet_id
+            }))
+            return
         
         # Register the BMS connection
         self.bms_manager.register_bms(bms_id, websocket)
@@ -119,6 +208,7 @@ class MessageRouter:
             "type": "bms_register_response",
             "status": "Registered",
             "bms_id": bms_id,
+            "resume_key": self.user_manager.resume_key,
             "packet_id": packet_id
         }
         await websocket.send(json.dumps(registration_response))
@@ -155,11 +245,14 @@ class MessageRouter:
         
         # Validate authentication
         secret_key = self.user_manager.users.get(user_id, {}).get("secret_key")
-        if secret_key and self.user_manager.authenticate_user(user_id, response, secret_key):
+        previous_bms = self.user_manager.get_user_location(user_id)
+        if secret_key and self.user_manager.authenticate_user(user_id, response, secret_key, msg.get("bms_id")):
+            await self.invalidate_location(user_id, previous_bms, msg.get("bms_id"))
             auth_result = {
                 "type": "auth_result",
                 "status": "Authenticated",
                 "user_id": user_id,
+                "resume_token": self.user_manager.issue_resume_token(user_id),
                 "packet_id": packet_id
             }
             logger.info(f"User {user_id} authenticated successfully")
@@ -179,12 +272,36 @@ class MessageRouter:
         else:
             logger.error(f"BMS connection not found for {user_id}")
 
+    async def process_attach(self, msg):
+        """ Process a BMS notification that a user resumed their session with a token. """
+        user_id = msg.get("user_id")
+        previous_bms = self.user_manager.get_user_location(user_id)
+        if self.user_manager.attach_user(user_id, msg.get("bms_id"), msg.get("token", "")):
+            await self.invalidate_location(user_id, previous_bms, msg.get("bms_id"))
+        else:
+            logger.error(f"Rejected attach for user {user_id}")
+            bms_connection = self.bms_manager.get_bms_connection(msg.get("bms_id"))
+            if bms_connection:
+                await bms_connection.send(json.dumps({"type": "kick", "user_id": user_id}))
+
+    async def invalidate_location(self, user_id, previous_bms, bms_id):
+        """ Tell the BMS a user was last seen on that it no longer serves them. """
+        if not previous_bms or previous_bms == bms_id:
+            return
+        bms_connection = self.bms_manager.get_bms_connection(previous_bms)
+        if bms_connection:
+            invalidate_msg = {"type": "location_invalidate", "user_id": user_id, "bms_id": bms_id}
+            await bms_connection.send(json.dumps(invalidate_msg))
+
     async def process_logout(self, msg):
         """ Process user logout. """
         user_id = msg.get("user_id")
         packet_id = msg.get("packet_id")
         
-        if self.user_manager.logout_user(user_id):
+        if msg.get("reason") != "disconnect":
+            # An explicit logout ends the session for good, unlike a dropped connection
+            self.user_manager.revoke_resume_tokens(user_id)
+        if self.user_manager.logout_user(user_id, msg.get("bms_id")):
             logout_result = {
                 "type": "logout_result",
                 "status": "Logged out",
@@ -217,8 +334,9 @@ class MessageRouter:
         
         logger.info(f"Processing text message from {source_user} to {target_user}")
 
-        # Route message to the target BMS
-        bms_connection = self.bms_manager.get_bms_connection(msg.get("bms_id"))
+        # Route message to the BMS the target is attached to
+        target_bms = self.user_manager.get_user_location(target_user) or msg.get("bms_id")
+        bms_connection = self.bms_manager.get_bms_connection(target_bms)
         if bms_connection:
             text_msg = {
                 "type": "text",
@@ -231,10 +349,87 @@ class MessageRouter:
         else:
             logger.error(f"BMS connection not found for {source_user}")
 
+    async def process_text_record(self, msg):
+        """ Record a text a BMS delivered locally without routing it through the MSC. """
+        logger.info(
+            f"Accounting: {msg.get('source_user')} -> {msg.get('target_user')} "
+            f"({msg.get('length')} chars) switched locally on {msg.get('bms_id')}"
+        )
+
+# Admin commands for live inspection and control of the MSC
+class MSCAdmin:
+    def __init__(self, user_manager: UserManager, bms_manager: BMSConnectionManager):
+        self.user_manager = user_manager
+        self.bms_manager = bms_manager
+
+    def commands(self):
+        return {
+            "stats": self.stats,
+            "list_bms": self.list_bms,
+            "list_users": self.list_users,
+            "kick_user": self.kick_user,
+            "drain_bms": self.drain_bms
+        }
+
+    @staticmethod
+    def write_buffer_size(websocket):
+        """ Bytes queued on a connection that have not been written to the socket yet. """
+        transport = getattr(websocket, "transport", None)
+        return transport.get_write_buffer_size() if transport else 0
+
+    async def stats(self):
+        """ Summarise table sizes and outbound queue depth. """
+        return {
+            "bms_count": len(self.bms_manager.bms_connections),
+            "known_users": len(self.user_manager.users),
+            "authenticated_users": len(self.user_manager.authenticated),
+            "bms_write_buffer_bytes": sum(
+                self.write_buffer_size(ws) for ws in self.bms_manager.bms_connections.values()
+            )
+        }
+
+    async def list_bms(self, after=None, limit=None):
+        """ Page through registered BMS connections. """
+        return paginate(
+            self.bms_manager.bms_connections, after, limit,
+            lambda bms_id, ws: {
+                "bms_id": bms_id,
+                "remote_address": str(getattr(ws, "remote_address", None)),
+                "write_buffer_bytes": self.write_buffer_size(ws)
+            }
+        )
+
+    async def list_users(self, after=None, limit=None):
+        """ Page through authenticated users and their current BMS. """
+        return paginate(
+            self.user_manager.authenticated, after, limit,
+            lambda user_id, bms_id: {"user_id": user_id, "bms_id": bms_id}
+        )
+
+    async def kick_user(self, user_id):
+        """ Log a user out and tell their BMS to drop the connection. """
+        bms_id = self.user_manager.get_user_location(user_id)
+        self.user_manager.revoke_resume_tokens(user_id)
+        if not self.user_manager.logout_user(user_id):
+            raise ValueError(f"Unknown user: {user_id}")
+        bms_connection = self.bms_manager.get_bms_connection(bms_id)
+        if bms_connection:
+            await bms_connection.send(json.dumps({"type": "kick", "user_id": user_id}))
+        return {"user_id": user_id, "bms_id": bms_id}
+
+    async def drain_bms(self, bms_id, server_url=None):
+        """ Ask a BMS to stop accepting users and hand its users over to server_url. """
+        bms_connection = self.bms_manager.get_bms_connection(bms_id)
+        if not bms_connection:
+            raise ValueError(f"Unknown BMS: {bms_id}")
+        await bms_connection.send(json.dumps({"type": "drain", "bms_id": bms_id, "server_url": server_url}))
+        return {"bms_id": bms_id, "server_url": server_url}
+
 # Instantiate shared managers and router
 user_manager = UserManager()
 bms_manager = BMSConnectionManager()
 message_router = MessageRouter(user_manager, bms_manager)
+msc_admin = MSCAdmin(user_manager, bms_manager)
 
 async def websocket_handler(websocket, path):
     """Handle WebSocket connections and messages."""
@@ -242,19 +437,106 @@ async def websocket_handler(websocket, path):
     try:
         async for message in websocket:
             await message_router.handle_message(websocket, message)
-    except websockets.exceptions.ConnectionClosed as e:
+    except CONNECTION_CLOSED as e:
         logger.info(f"Connection closed: {e}")
     finally:
         logger.info(f"Connection from {websocket.remote_address} closed.")
 
-async def start_server(host: str, port: int):
-    """Start the WebSocket server."""
-    server = await websockets.serve(
-        websocket_handler,
-        host, port
-    )
+def save_snapshot(path: str):
+    """Atomically write MSC state to disk."""
+    data = {"saved_at": time.time(), "user_manager": user_manager.snapshot()}
+    os.makedirs(os.path.dirname(os.path.abspath(path)), mode=0o700, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "w") as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+    logger.info(f"Saved MSC snapshot to {path}")
+
+def load_snapshot(path: str):
+    """Restore MSC state from a recent snapshot, if there is one."""
+    try:
+        with open(path) as f:
+            data = json.load(f)
+    except FileNotFoundError:
+        return False
+    except ValueError as e:
+        logger.error(f"Ignoring unreadable snapshot {path}: {e}")
+        return False
+
+    age = time.time() - data.get("saved_at", 0)
+    if age > SNAPSHOT_MAX_AGE:
+        logger.warning(f"Ignoring stale snapshot {path} ({age:.0f}s old)")
+        return False
+    user_manager.restore(data.get("user_manager", {}))
+    return True
+
+def listening_socket(host: str, port: int):
+    """Inherit the listening socket from a previous MSC, or open a new one."""
+    listen_fd = os.environ.pop(LISTEN_FD_ENV, None)
+    if listen_fd:
+        logger.info(f"Inherited listening socket fd {listen_fd}")
+        return socket.socket(fileno=int(listen_fd))
+    return socket.create_server((host, port))
+
+def spawn_successor(sock: socket.socket):
+    """Start a new MSC process that takes over the listening socket."""
+    fd = sock.fileno()
+    os.set_inheritable(fd, True)
+    env = dict(os.environ, **{LISTEN_FD_ENV: str(fd)})
+    process = subprocess.Popen([sys.executable] + sys.argv, env=env, pass_fds=(fd,))
+    logger.info(f"Started successor MSC with pid {process.pid}")
+
+async def start_server(host: str, port: int, admin_socket: str = None, snapshot_path: str = None, transport=None,
+                       stop: asyncio.Future = None):
+    """Start the WebSocket server.
+
+    SIGTERM/SIGINT drain the server and snapshot its state to snapshot_path.
+    SIGUSR2 does the same and then starts a new MSC on the same listening
+    socket, which warm starts from the snapshot.
+
+    transport defaults to WebSocketTransport; pass a MemoryTransport to run
+    the MSC in-process without sockets. Passing a `stop` future replaces the
+    signal handlers: set its result to "shutdown" or "restart" to drain.
+    """
+    transport = transport or WebSocketTransport()
+    if snapshot_path:
+        load_snapshot(snapshot_path)
+
+    if stop is None:
+        loop = asyncio.get_running_loop()
+        stop = loop.create_future()
+        for sig, action in ((signal.SIGTERM, "shutdown"), (signal.SIGINT, "shutdown"),
+                            (getattr(signal, "SIGUSR2", None), "restart")):
+            if sig is not None:
+                loop.add_signal_handler(sig, lambda action=action: stop.done() or stop.set_result(action))
+
+    admin_server = AdminServer(admin_socket, msc_admin.commands()) if admin_socket else None
+    if admin_server:
+        await admin_server.start()
+    sock = listening_socket(host, port) if transport.uses_sockets else None
+    if sock:
+        server = await transport.serve(websocket_handler, sock=sock)
+    else:
+        server = await transport.serve(websocket_handler, host, port)
     logger.info(f"MSC WebSocket server started on ws://{host}:{port}")
+
+    action = await stop
+    logger.info(f"Draining MSC for {action}")
+    # Keep a copy of the listening socket so pending connections queue in the
+    # kernel backlog instead of being refused while the successor starts.
+    handoff_sock = sock.dup() if sock and action == "restart" else None
+
+    # Stop accepting, let in-flight messages finish, then close connections
+    server.close()
     await server.wait_closed()
+    if admin_server:
+        await admin_server.close()
+
+    if snapshot_path:
+        save_snapshot(snapshot_path)
+    if handoff_sock:
+        spawn_successor(handoff_sock)
 
-def main(host: str, port: int):
-    asyncio.run(start_server(host, port))
+def main(host: str, port: int, admin_socket: str = None, snapshot_path: str = DEFAULT_SNAPSHOT_PATH):
+    asyncio.run(start_server(host, port, admin_socket, snapshot_path))
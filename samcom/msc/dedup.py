@@ -0,0 +1,71 @@
+import time
+from collections import OrderedDict
+from ..common.exchange import parse_packet_id
+
+
+class DuplicateFilter:
+    """ Sliding-window duplicate detector for packet ids, per origin.
+
+    For each origin we keep the sender epoch, the highest counter seen and a
+    bitmap of which of the previous `window` counters have arrived, like an
+    IPsec anti-replay window. Origins are evicted least recently used first
+    beyond `max_origins`, so memory stays bounded whatever the packet rate.
+
+    Packets the window cannot judge (older than the window, or from an
+    earlier epoch of the sender) are let through rather than dropped, as the
+    BMS uplink scheduler reorders a user's control packets ahead of its texts.
+    """
+
+    WINDOW = 1024
+    MAX_ORIGINS = 100000
+    MAX_EPOCH_SKEW = 300000  # Milliseconds an epoch may be ahead of our clock
+
+    def __init__(self, window=WINDOW, max_origins=MAX_ORIGINS):
+        self.window = window
+        self.mask = (1 << window) - 1
+        self.max_origins = max_origins
+        self.origins = OrderedDict()  # origin -> [epoch, highest counter, bitmap]
+
+    def seen(self, packet_id, origins=()):
+        """ Record packet_id and return True if it was already seen.
+
+        Only ids whose origin is one of `origins` (the senders the message
+        claims to come from) are tracked, so nobody can poison another
+        sender's window.
+        """
+        parsed = parse_packet_id(packet_id)
+        if parsed is None:
+            return False  # Ids without an origin cannot be checked
+        origin, epoch, counter = parsed
+        if origin not in origins:
+            return False
+        if epoch > time.time() * 1000 + self.MAX_EPOCH_SKEW:
+            return False  # Implausible epoch, don't let it reset the window
+
+        state = self.origins.get(origin)
+        if state is None or epoch > state[0]:
+            # New sender, or the sender restarted and began a new counter
+            self.origins[origin] = [epoch, counter, 1]
+            self.origins.move_to_end(origin)
+            if len(self.origins) > self.max_origins:
+                self.origins.popitem(last=False)
+            return False
+        self.origins.move_to_end(origin)
+        if epoch < state[0]:
+            return False  # Sent before the sender restarted, can't tell
+
+        highest, bitmap = state[1], state[2]
+        if counter > highest:
+            shift = counter - highest
+            state[1] = counter
+            state[2] = ((bitmap << shift) | 1) & self.mask if shift < self.window else 1
+            return False
+
+        offset = highest - counter
+        if offset >= self.window:
+            return False  # Older than the window, can't tell
+        bit = 1 << offset
+        if bitmap & bit:
+            return True
+        state[2] = bitmap | bit
+        return False
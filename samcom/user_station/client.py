@@ -0,0 +1,233 @@
+import asyncio
+import json
+import logging
+from ..common.exchange import generate_challenge, make_packet_id, packet_epoch
+from ..common.transport import CONNECTION_CLOSED, WebSocketTransport
+
+logger = logging.getLogger(__name__)
+
+
+class AuthenticationError(Exception):
+    pass
+
+
+class Session:
+    """ One subscriber session on a BMS, run entirely on the caller's event loop.
+
+    Incoming text messages are put on `incoming`. Sessions opened through a
+    StationClient share the client's queue, a standalone session has its own.
+    If the session ends after it was opened for any reason other than close()
+    (a kick, a dropped connection, a failed handover), a
+    {"type": "session_error", "user_id": ..., "error": ...} item is put there
+    and `on_lost` is called with the session.
+    """
+
+    AUTH_TIMEOUT = 10  # Seconds to wait for auth_result
+
+    def __init__(self, user_id: str, secret_key: str, server_url: str, incoming: asyncio.Queue = None,
+                 transport=None, on_lost=None):
+        self.user_id = user_id
+        self.transport = transport or WebSocketTransport()
+        self.secret_key = secret_key
+        self.server_url = server_url
+        self.incoming = incoming if incoming is not None else asyncio.Queue()
+        self.websocket = None
+        self.resume_token = None
+        self.packet_epoch = packet_epoch()
+        self.packet_id_counter = 0
+        self.reader_task = None
+        self.reconnect_task = None
+        self.auth_result = None
+        self.on_lost = on_lost
+        self.closing = False
+        self.end_reason = None  # Why the network ended the session, if it said
+
+    def generate_packet_id(self):
+        self.packet_id_counter += 1
+        return make_packet_id(self.user_id, self.packet_epoch, self.packet_id_counter)
+
+    async def send_message(self, message):
+        await self.websocket.send(json.dumps(message))
+
+    async def connect(self):
+        """ Connect and authenticate, resuming with a token when we have one. """
+        self.websocket = await self.transport.connect(self.server_url)
+        self.auth_result = asyncio.get_running_loop().create_future()
+        self.reader_task = asyncio.create_task(self.read_messages(self.websocket, self.auth_result))
+
+        if self.resume_token:
+            auth_message = {"type": "resume", "user_id": self.user_id, "token": self.resume_token}
+        else:
+            auth_message = {"type": "auth", "user_id": self.user_id}
+        auth_message["packet_id"] = self.generate_packet_id()
+        await self.send_message(auth_message)
+
+        try:
+            result = await asyncio.wait_for(self.auth_result, self.AUTH_TIMEOUT)
+        except asyncio.TimeoutError:
+            await self.disconnect()
+            raise AuthenticationError(f"Timed out authenticating {self.user_id}")
+        if result.get("status") != "Authenticated":
+            self.resume_token = None
+            await self.disconnect()
+            raise AuthenticationError(f"Authentication failed for {self.user_id}")
+        self.resume_token = result.get("resume_token") or self.resume_token
+
+    async def read_messages(self, websocket, auth_result):
+        try:
+            async for raw in websocket:
+                await self.process_message(json.loads(raw))
+        except CONNECTION_CLOSED:
+            logger.info(f"Session {self.user_id} disconnected.")
+        finally:
+            if not auth_result.done():
+                auth_result.set_result({"status": "Failed"})  # connect() raises for us
+            elif self.was_lost(websocket, auth_result):
+                await self.lost(self.end_reason or "Connection lost")
+
+    def was_lost(self, websocket, auth_result):
+        """ Whether the end of this connection ended an open session nobody closed. """
+        if self.closing or websocket is not self.websocket:
+            return False  # Closed on purpose, or already replaced by a reconnect
+        if self.reconnect_task and not self.reconnect_task.done():
+            return False  # The reconnect reports its own failure
+        return not auth_result.cancelled() and auth_result.result().get("status") == "Authenticated"
+
+    async def lost(self, error):
+        """ Close the session and report why, once. """
+        if self.closing:
+            return
+        logger.error(f"Session {self.user_id} lost: {error}")
+        await self.close()
+        if self.on_lost:
+            self.on_lost(self)
+        await self.incoming.put({"type": "session_error", "user_id": self.user_id, "error": error})
+
+    async def process_message(self, data):
+        msg_type = data.get("type")
+        if msg_type == "challenge":
+            await self.send_message({
+                "type": "auth_response",
+                "user_id": self.user_id,
+                "challenge": data["challenge"],
+                "response": generate_challenge(self.user_id, self.secret_key),
+                "packet_id": self.generate_packet_id()
+            })
+        elif msg_type == "auth_result":
+            if not self.auth_result.done():
+                self.auth_result.set_result(data)
+        elif msg_type == "text":
+            await self.incoming.put(data)
+        elif msg_type == "handover" and data.get("server_url"):
+            self.server_url = data["server_url"]
+            self.reconnect_task = asyncio.create_task(self.reconnect())
+        elif msg_type == "kick":
+            self.resume_token = None
+            self.end_reason = "Kicked by the network"
+        elif msg_type == "handover":
+            self.end_reason = "Handed over with no server to move to"
+        else:
+            logger.debug(f"Unhandled message for {self.user_id}: {data}")
+
+    async def reconnect(self):
+        """ Re-establish the session after a handover, reporting failure on `incoming`. """
+        try:
+            await self.connect()
+        except (AuthenticationError, OSError) as e:
+            await self.lost(f"Handover failed: {e}")
+
+    async def send_text(self, target_user, message):
+        """ Send a text message and return its packet id. """
+        packet_id = self.generate_packet_id()
+        await self.send_message({
+            "type": "text",
+            "source_user": self.user_id,
+            "target_user": target_user,
+            "message": message,
+            "packet_id": packet_id
+        })
+        return packet_id
+
+    async def logout(self):
+        self.resume_token = None
+        await self.send_message({"type": "auth_logout", "user_id": self.user_id, "packet_id": self.generate_packet_id()})
+        await self.close()
+
+    async def close(self):
+        self.closing = True
+        await self.disconnect()
+
+    async def disconnect(self):
+        if self.reconnect_task and self.reconnect_task is not asyncio.current_task():
+            self.reconnect_task.cancel()
+        if self.websocket:
+            await self.websocket.close()
+        if self.reader_task and self.reader_task is not asyncio.current_task():
+            await self.reader_task
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.incoming.get()
+
+
+class StationClient:
+    """ Many subscriber sessions sharing one event loop and one incoming stream.
+
+    Usage:
+        async with StationClient("ws://localhost:9001") as client:
+            session = await client.open_session("1234567890", "secretkey123")
+            await session.send_text("0987654321", "Hello")
+            async for message in client:
+                print(message["target_user"], message["source_user"], message["message"])
+
+    The BMS binds one user to each websocket, so every session uses its own
+    connection; no threads or polling are involved. A session the network
+    ends is dropped from `sessions` and reported as a session_error item.
+    """
+
+    def __init__(self, server_url: str, transport=None):
+        self.server_url = server_url
+        self.transport = transport
+        self.sessions = {}
+        self.incoming = asyncio.Queue()
+
+    async def open_session(self, user_id, secret_key, server_url=None):
+        session = Session(user_id, secret_key, server_url or self.server_url, self.incoming, self.transport,
+                          self.forget_session)
+        self.sessions[user_id] = session  # Before connecting, so an early kick can remove it
+        try:
+            await session.connect()
+        except BaseException:
+            self.forget_session(session)
+            raise
+        return session
+
+    def forget_session(self, session):
+        if self.sessions.get(session.user_id) is session:
+            del self.sessions[session.user_id]
+
+    async def send_text(self, source_user, target_user, message):
+        return await self.sessions[source_user].send_text(target_user, message)
+
+    async def close_session(self, user_id):
+        session = self.sessions.pop(user_id, None)
+        if session:
+            await session.close()
+
+    async def close(self):
+        await asyncio.gather(*(session.close() for session in self.sessions.values()))
+        self.sessions.clear()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        return await self.incoming.get()
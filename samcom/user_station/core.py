@@ -1,18 +1,33 @@
 import asyncio
-import websockets
 import json
 import queue
-from ..common.exchange import generate_challenge
+import threading
+import time
+from ..common.exchange import generate_challenge, make_packet_id, packet_epoch
+from ..common.transport import WebSocketTransport
+from .history import MessageHistory, default_history_path
 
 
 class StationInterface:
+    UI_DRAIN_BUDGET = 0.02  # Seconds spent handling queued items per wakeup
+
     def __init__(self):
         self.server_url: str = None
         self.username: str = None
         self.password: str = None
         self.incoming_queue = queue.Queue()
+        self.wakeup_lock = threading.Lock()
+        self.wakeup_pending = False  # A wakeup was sent and the queue not drained since
         self.user_station: 'UserStation' = None
-        self.messages = {}  # Dictionary to store messages for each user
+        self.history_path: str = None  # Defaults to a per-user file under ~/.samcom
+        self._history: MessageHistory = None
+
+    @property
+    def history(self) -> MessageHistory:
+        """ Message history for the logged in user, opened on first use. """
+        if self._history is None:
+            self._history = MessageHistory(self.history_path or default_history_path(self.username))
+        return self._history
 
     def send_text_message(self, target_user, message):
         self.user_station.task_queue.put({"action": "text", "target_user": target_user, "message": message})
@@ -27,33 +42,57 @@ class StationInterface:
         self.user_station = UserStation(self)
         self.user_station.start()
 
+    def post(self, message):
+        """ Queue an item for the interface thread, waking it up if it isn't already. """
+        self.incoming_queue.put(message)
+        with self.wakeup_lock:
+            if self.wakeup_pending:
+                return
+            self.wakeup_pending = True
+        self.wakeup()
+
+    def wakeup(self):
+        """ Called from the UserStation thread after an item is queued. """
+        pass
+
     def process_ui_queue(self):
-        try:
-            message = self.incoming_queue.get_nowait()
-            if hasattr(self, f"process_{message['action']}"):
-                getattr(self, f"process_{message["action"]}")(message)
+        """ Handle queued items until the queue is empty or the time budget is spent. """
+        deadline = time.monotonic() + self.UI_DRAIN_BUDGET
+        processed = 0
+        with self.wakeup_lock:
+            # Items posted from now on need a new wakeup
+            self.wakeup_pending = False
+        while True:
+            try:
+                message = self.incoming_queue.get_nowait()
+            except queue.Empty:
+                break
+            handler = getattr(self, f"process_{message['action']}", None)
+            if handler:
+                handler(message)
             else:
                 print(f"No handler found for interface task: {message['action']}")
-
-        except queue.Empty:
-            pass
+            processed += 1
+            if time.monotonic() >= deadline:
+                break
+        return processed
 
     def process_message(self, message):
         if message["action"] == "message":
             source_user = message["source_user"]
             message = message["message"]
             formatted_message = f"{source_user}: {message}"
-            if source_user in self.messages:
-                self.messages[source_user].append(formatted_message)
-            else:
-                self.messages[source_user] = [formatted_message]
+            self.history.append(source_user, formatted_message)
 
 
 class UserStation:
-    def __init__(self, interface: StationInterface):
+    def __init__(self, interface: StationInterface, transport=None):
         self.interface = interface
+        self.transport = transport or WebSocketTransport()
+        self.packet_epoch = packet_epoch()
         self.packet_id_counter = 0
         self.websocket = None
+        self.resume_token = None
         self.task_queue = queue.Queue()
         self.interface.user_station = self
 
@@ -67,20 +106,29 @@ class UserStation:
 
     def generate_packet_id(self):
         self.packet_id_counter += 1
-        return str(self.packet_id_counter)
+        return make_packet_id(self.interface.username, self.packet_epoch, self.packet_id_counter)
 
     async def connect(self):
-        self.websocket = await websockets.connect(self.interface.server_url)
+        self.websocket = await self.transport.connect(self.interface.server_url)
         print("Connected to BMS.")
         await self.authenticate()
 
     async def authenticate(self):
         packet_id = self.generate_packet_id()
-        auth_message = {
-            "type": "auth",
-            "user_id": self.interface.username,
-            "packet_id": packet_id
-        }
+        if self.resume_token:
+            # Let the BMS resume the session without a challenge
+            auth_message = {
+                "type": "resume",
+                "user_id": self.interface.username,
+                "token": self.resume_token,
+                "packet_id": packet_id
+            }
+        else:
+            auth_message = {
+                "type": "auth",
+                "user_id": self.interface.username,
+                "packet_id": packet_id
+            }
         await self.send_message(auth_message)
 
     async def respond_to_challenge(self, challenge, packet_id):
@@ -109,17 +157,33 @@ class UserStation:
             print("Received:", data)
 
             if data.get("type") == "challenge":
-                await self.respond_to_challenge(data["challenge"], data["packet_id"])
+                await self.respond_to_challenge(data["challenge"], self.generate_packet_id())
             elif data.get("type") == "auth_result":
                 if data.get("status") == "Authenticated":
                     print("Authentication successful!")
-                    self.interface.incoming_queue.put({"action": "authenticated"})
+                    if data.get("resume_token"):
+                        self.resume_token = data["resume_token"]
+                    self.interface.post({"action": "authenticated"})
                 else:
                     print("Authentication failed!")
+                    self.resume_token = None
+            elif data.get("type") == "kick":
+                print("Disconnected by the network.")
+                self.websocket = None
+                self.resume_token = None
+                self.interface.post({"action": "kicked"})
+            elif data.get("type") == "handover":
+                print("Handed over to:", data.get("server_url"))
+                self.websocket = None
+                if data.get("server_url"):
+                    self.interface.server_url = data["server_url"]
+                    await self.connect()
+                else:
+                    self.interface.post({"action": "kicked"})
             elif data.get("type") == "text":
                 source_user = data["source_user"]
                 message = data["message"]
-                self.interface.incoming_queue.put({"action": "message", "source_user": source_user, "message": message})
+                self.interface.post({"action": "message", "source_user": source_user, "message": message})
 
     async def process_tasks(self):
         while True:
@@ -135,6 +199,7 @@ class UserStation:
                 await self.send_text_message(task["target_user"], task["message"])
 
     async def logout(self):
+        self.resume_token = None
         packet_id = self.generate_packet_id()
         logout_message = {
             "type": "auth_logout",
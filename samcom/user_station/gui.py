@@ -3,22 +3,30 @@ from tkinter import simpledialog, messagebox
 import threading
 from .core import UserStation, StationInterface
 
+# Virtual event generated on the active window when the UI queue has items
+UI_QUEUE_EVENT = "<<UIQueue>>"
+
 
 class GuiInterface(StationInterface):
+    PAGE_SIZE = 100  # Messages loaded per page of scroll-back
+    UI_POLL_INTERVAL = 250  # Fallback queue check (ms) in case a wakeup is missed
+
     def __init__(self,):
         super().__init__()
         self.root = None  # Delay main window creation
         self.login_dialog = None
+        self.ui_window = None  # Window that receives UI queue wakeups
+        self.pending_display = []  # Lines waiting to be inserted into the message area
+        self.oldest_loaded_id = None  # Oldest message shown for the selected user
+        self.history_exhausted = False
+        self.loading_older = False
 
     def process_message(self, message):
         if message["action"] == "message":
             source_user = message["source_user"]
             message = message["message"]
             formatted_message = f"{source_user}: {message}"
-            if source_user in self.messages:
-                self.messages[source_user].append(formatted_message)
-            else:
-                self.messages[source_user] = [formatted_message]
+            self.history.append(source_user, formatted_message)
             if self.selected_user == source_user:
                 self.display_message(formatted_message)
 
@@ -27,6 +35,10 @@ class GuiInterface(StationInterface):
             self.login_dialog.destroy()
             self.create_main_window()
 
+    def process_kicked(self, message):
+        if message["action"] == "kicked":
+            messagebox.showwarning("Disconnected", "You have been disconnected by the network.")
+
     def init_login_dialog(self):
         # Create a custom dialog for username and password input
         self.login_dialog = tk.Tk()
@@ -68,11 +80,30 @@ class GuiInterface(StationInterface):
         if not self.username or not self.password:
             exit()
 
+    def wakeup(self):
+        # Runs on the UserStation thread, Tk delivers the event on the GUI thread
+        try:
+            if self.ui_window is not None:
+                self.ui_window.event_generate(UI_QUEUE_EVENT, when="tail")
+        except (tk.TclError, RuntimeError):
+            pass  # Window is being replaced, the fallback check will pick the item up
+
+    def process_ui_queue(self):
+        processed = super().process_ui_queue()
+        self.flush_display()
+        return processed
+
     def start_ui_queue_check(self, window):
+        def drain(event=None):
+            if self.process_ui_queue() and not self.incoming_queue.empty():
+                window.after(1, drain)  # Budget spent, carry on after the next redraw
+
         def check_ui_queue():
-            self.process_ui_queue()
-            window.after(100, check_ui_queue)  # Check the queue periodically
+            drain()
+            window.after(self.UI_POLL_INTERVAL, check_ui_queue)
 
+        window.bind(UI_QUEUE_EVENT, drain)
+        self.ui_window = window
         check_ui_queue()
 
     def create_main_window(self):
@@ -112,6 +143,8 @@ class GuiInterface(StationInterface):
         self.users_listbox = tk.Listbox(self.left_pane)
         self.users_listbox.pack(fill="both", expand=True)
         self.users_listbox.bind("<<ListboxSelect>>", self.on_user_select)
+        for peer in self.history.peers():
+            self.users_listbox.insert(tk.END, peer)
 
         # Right pane components (message display area)
         self.message_area = tk.Text(
@@ -119,7 +152,8 @@ class GuiInterface(StationInterface):
             state=tk.DISABLED,
             wrap=tk.WORD,
             height=20,
-            width=50
+            width=50,
+            yscrollcommand=self.on_message_scroll
         )
         self.message_area.pack(side="top", fill="both", expand=True)
 
@@ -135,7 +169,7 @@ class GuiInterface(StationInterface):
         recipient = simpledialog.askstring("New Chat", "Enter User ID to chat with:")
         if recipient and recipient not in self.users_listbox.get(0, tk.END):
             self.users_listbox.insert(tk.END, recipient)
-            self.messages[recipient] = []  # Initialise message list for the new user
+            self.history.add_peer(recipient)
 
     def on_user_select(self, event):
         # Handle user selection from the listbox
@@ -145,30 +179,59 @@ class GuiInterface(StationInterface):
             self.update_message_area()
 
     def update_message_area(self):
-        # Clear the message area and populate with selected user's messages
+        # Clear the message area and show the latest page of the selected user's messages
+        rows = self.history.page(self.selected_user, limit=self.PAGE_SIZE)
+        self.oldest_loaded_id = rows[0][0] if rows else None
+        self.history_exhausted = len(rows) < self.PAGE_SIZE
         self.message_area.config(state=tk.NORMAL)
         self.message_area.delete(1.0, tk.END)
-        if self.selected_user in self.messages:
-            for message in self.messages[self.selected_user]:
-                self.message_area.insert(tk.END, message + "\n")
+        self.message_area.insert(tk.END, "".join(text + "\n" for _, text in rows))
         self.message_area.config(state=tk.DISABLED)
         self.message_area.yview(tk.END)
 
+    def load_older_messages(self):
+        # Prepend the previous page of history, keeping the current view in place
+        self.loading_older = False
+        rows = self.history.page(self.selected_user, before_id=self.oldest_loaded_id, limit=self.PAGE_SIZE)
+        self.history_exhausted = len(rows) < self.PAGE_SIZE
+        if not rows:
+            return
+        self.oldest_loaded_id = rows[0][0]
+        self.message_area.config(state=tk.NORMAL)
+        self.message_area.insert(1.0, "".join(text + "\n" for _, text in rows))
+        self.message_area.config(state=tk.DISABLED)
+        self.message_area.yview(f"{len(rows) + 1}.0")
+
+    def on_message_scroll(self, first, last):
+        # Fetch scroll-back on demand when the view reaches the top
+        if float(first) <= 0.0 and self.oldest_loaded_id is not None \
+                and not self.history_exhausted and not self.loading_older:
+            self.loading_older = True
+            self.message_area.after_idle(self.load_older_messages)
+
     def on_send_message(self, event=None):
         if self.selected_user:
             message = self.message_input.get().strip()
             if message:
                 formatted_message = f"You: {message}"
-                self.messages[self.selected_user].append(formatted_message)
+                self.history.append(self.selected_user, formatted_message)
                 self.display_message(formatted_message)
+                self.flush_display()
                 self.message_input.delete(0, tk.END)
                 self.user_station.task_queue.put({"action": "text", "target_user": self.selected_user, "message": message})
 
     def display_message(self, message):
+        # Buffered until flush_display so a burst becomes a single insert
+        self.pending_display.append(message + "\n")
+
+    def flush_display(self):
+        if not self.pending_display:
+            return
         self.message_area.config(state=tk.NORMAL)
-        self.message_area.insert(tk.END, message + "\n")
+        self.message_area.insert(tk.END, "".join(self.pending_display))
         self.message_area.config(state=tk.DISABLED)
         self.message_area.yview(tk.END)
+        self.pending_display.clear()
 
 
 def main():
@@ -0,0 +1,58 @@
+import os
+import sqlite3
+
+HISTORY_DIR = os.path.join(os.path.expanduser("~"), ".samcom")
+
+
+def default_history_path(username):
+    os.makedirs(HISTORY_DIR, exist_ok=True)
+    return os.path.join(HISTORY_DIR, f"history-{username}.db")
+
+
+class MessageHistory:
+    """ Conversation history stored in SQLite, indexed by peer. """
+
+    def __init__(self, path=":memory:"):
+        self.db = sqlite3.connect(path)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.execute("CREATE TABLE IF NOT EXISTS peers (peer TEXT PRIMARY KEY)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS messages ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, peer TEXT NOT NULL, text TEXT NOT NULL)"
+        )
+        self.db.execute("CREATE INDEX IF NOT EXISTS messages_peer_id ON messages (peer, id)")
+        self.db.commit()
+
+    def add_peer(self, peer):
+        """ Remember a conversation even before it has any messages. """
+        self.db.execute("INSERT OR IGNORE INTO peers (peer) VALUES (?)", (peer,))
+        self.db.commit()
+
+    def peers(self):
+        return [row[0] for row in self.db.execute("SELECT peer FROM peers ORDER BY rowid")]
+
+    def append(self, peer, text):
+        """ Append a formatted message to a conversation and return its id. """
+        self.db.execute("INSERT OR IGNORE INTO peers (peer) VALUES (?)", (peer,))
+        cursor = self.db.execute("INSERT INTO messages (peer, text) VALUES (?, ?)", (peer, text))
+        self.db.commit()
+        return cursor.lastrowid
+
+    def page(self, peer, before_id=None, limit=100):
+        """ Return up to limit (id, text) rows older than before_id, oldest first. """
+        if before_id is None:
+            rows = self.db.execute(
+                "SELECT id, text FROM messages WHERE peer = ? ORDER BY id DESC LIMIT ?",
+                (peer, limit)
+            ).fetchall()
+        else:
+            rows = self.db.execute(
+                "SELECT id, text FROM messages WHERE peer = ? AND id < ? ORDER BY id DESC LIMIT ?",
+                (peer, before_id, limit)
+            ).fetchall()
+        rows.reverse()
+        return rows
+
+    def close(self):
+        self.db.close()
@@ -1,7 +1,8 @@
-from samcom.msc.core import main
+from samcom.msc.core import DEFAULT_SNAPSHOT_PATH, main
 
 if __name__ == "__main__":
     HOST = "localhost"
     PORT = 9000
-    main(HOST, PORT)
+    SNAPSHOT_PATH = DEFAULT_SNAPSHOT_PATH
+    main(HOST, PORT, snapshot_path=SNAPSHOT_PATH)
     
\ No newline at end of file
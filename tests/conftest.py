@@ -0,0 +1,26 @@
+import pytest
+
+from samcom.msc import core as msc
+
+
+def reset_msc(monkeypatch):
+    """ Replace the MSC singletons, as a newly started MSC process has them. """
+    user_manager = msc.UserManager()
+    bms_manager = msc.BMSConnectionManager()
+    monkeypatch.setattr(msc, "user_manager", user_manager)
+    monkeypatch.setattr(msc, "bms_manager", bms_manager)
+    monkeypatch.setattr(msc, "message_router", msc.MessageRouter(user_manager, bms_manager))
+    monkeypatch.setattr(msc, "msc_admin", msc.MSCAdmin(user_manager, bms_manager))
+    return user_manager
+
+
+@pytest.fixture
+def fresh_msc(monkeypatch):
+    """ The MSC module with clean state and a second known user, "555". """
+    reset_msc(monkeypatch).users["555"] = {"authenticated": False, "secret_key": "k5"}
+    return msc
+
+
+@pytest.fixture
+def restart_msc(monkeypatch):
+    return lambda: reset_msc(monkeypatch)
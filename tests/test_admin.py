@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+import random
+import stat
+import threading
+
+import pytest
+
+from samcom.common.admin import AdminServer, IndexedDict, paginate
+
+
+def all_pages(mapping, limit, between_pages=None):
+    keys, after = [], None
+    while True:
+        page = paginate(mapping, after, limit)
+        keys.extend(page["items"])
+        after = page["next_cursor"]
+        if after is None:
+            return keys
+        if between_pages:
+            between_pages()
+
+
+def test_index_tracks_dict_mutations():
+    table = IndexedDict({f"{n:05d}": n for n in range(5000)})
+    rng = random.Random(1)
+    for _ in range(3000):
+        key = f"{rng.randrange(7000):05d}"
+        if rng.random() < 0.5:
+            table[key] = 0
+        else:
+            table.pop(key, None)
+    del table[next(iter(table))]
+
+    assert all_pages(table, 1000) == sorted(table)
+
+
+def test_non_str_key_is_refused_without_breaking_the_index():
+    table = IndexedDict({"B1": 1})
+    for bad_key in (None, 42):
+        with pytest.raises(TypeError):
+            table[bad_key] = 0
+    table["B2"] = 2
+    assert paginate(table)["items"] == ["B1", "B2"]
+
+
+def test_paging_is_stable_while_table_changes():
+    table = IndexedDict({f"u{n:05d}": n for n in range(3000)})
+    stable = set(table)
+    rng = random.Random(2)
+
+    def churn():
+        # Add and remove rows that were not there when the listing started
+        for _ in range(50):
+            table[f"x{rng.randrange(100000)}"] = 0
+            table.pop(f"x{rng.randrange(100000)}", None)
+
+    keys = all_pages(table, 100, churn)
+    listed_stable = [key for key in keys if key in stable]
+    assert listed_stable == sorted(stable)
+    assert len(keys) == len(set(keys))
+
+
+def test_page_size_is_capped():
+    table = IndexedDict({f"{n:05d}": n for n in range(5000)})
+    page = paginate(table, None, 10 ** 6)
+    assert len(page["items"]) == 1000
+    assert page["total"] == 5000
+
+
+def test_non_object_request_is_an_error():
+    async def stats():
+        return {}
+
+    server = AdminServer("/unused.sock", {"stats": stats})
+    for request in ("[]", "1", '"stats"', "null"):
+        response = asyncio.run(server.handle_request(request))
+        assert response["status"] == "error"
+    assert asyncio.run(server.handle_request(json.dumps({"command": "stats"})))["status"] == "ok"
+
+
+def test_index_stays_in_step_under_concurrent_updates():
+    table = IndexedDict()
+
+    def churn(seed):
+        rng = random.Random(seed)
+        for _ in range(20000):
+            key = f"{rng.randrange(500):03d}"
+            if rng.random() < 0.5:
+                table[key] = seed
+            else:
+                table.pop(key, None)
+
+    threads = [threading.Thread(target=churn, args=(seed,)) for seed in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        all_pages(table, 7)
+    for thread in threads:
+        thread.join()
+    assert all_pages(table, 7) == sorted(table)
+
+
+def test_admin_socket_is_private_and_removed_on_close(tmp_path):
+    socket_path = str(tmp_path / "admin.sock")
+
+    async def stats():
+        return {"ok": True}
+
+    async def scenario():
+        admin_server = AdminServer(socket_path, {"stats": stats})
+        await admin_server.start()
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        await admin_server.close()
+        assert not os.path.exists(socket_path)
+
+    asyncio.run(scenario())
@@ -0,0 +1,35 @@
+import asyncio
+import json
+
+from samcom.bms.core import BaseMessageStation
+from samcom.common.transport import MemoryTransport
+
+
+def test_auth_result_for_departed_user_is_not_local():
+    station = BaseMessageStation("B1", 1, "ws://msc:1", "B1")
+    station.msc_connection.process_message({"type": "auth_result", "status": "Authenticated", "user_id": "555"})
+    assert "555" not in station.local_subscribers
+
+
+def test_new_auth_clears_stale_local_entry():
+    async def scenario():
+        transport = MemoryTransport()
+        station = BaseMessageStation("B1", 1, "ws://msc:1", "B1", transport)
+        station.local_subscribers.add("555")
+        server = await transport.serve(station.handle_new_user, "B1", 1)
+
+        websocket = await transport.connect("ws://B1:1")
+        await websocket.send(json.dumps({"type": "auth", "user_id": "555", "packet_id": "555:1:1"}))
+        for _ in range(100):
+            if "555" in station.user_queues:
+                break
+            await asyncio.sleep(0.01)
+        assert "555" in station.user_queues
+        assert "555" not in station.local_subscribers
+
+        station.running = False
+        await websocket.close()
+        server.close()
+        await server.wait_closed()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
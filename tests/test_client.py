@@ -0,0 +1,100 @@
+import asyncio
+import json
+
+import pytest
+
+from samcom.common.transport import MemoryTransport
+from samcom.user_station.client import AuthenticationError, Session, StationClient
+
+
+def fake_bms(transport, host, on_auth):
+    """ Serve a BMS stand-in at ws://host:1 that calls on_auth(websocket, message). """
+    async def handler(websocket, path):
+        async for raw in websocket:
+            await on_auth(websocket, json.loads(raw))
+    return transport.serve(handler, host, 1)
+
+
+def test_connect_times_out_when_nobody_answers():
+    async def scenario():
+        transport = MemoryTransport()
+
+        async def ignore(websocket, message):
+            pass
+
+        async with fake_bms(transport, "bms", ignore):
+            session = Session("555", "k5", "ws://bms:1", transport=transport)
+            session.AUTH_TIMEOUT = 0.1
+            with pytest.raises(AuthenticationError):
+                await session.connect()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_failed_handover_is_reported_on_incoming():
+    async def scenario():
+        transport = MemoryTransport()
+
+        async def accept_then_hand_over(websocket, message):
+            await websocket.send(json.dumps({"type": "auth_result", "status": "Authenticated", "user_id": "555"}))
+            await websocket.send(json.dumps({"type": "handover", "user_id": "555", "server_url": "ws://gone:1"}))
+
+        async with fake_bms(transport, "bms", accept_then_hand_over):
+            session = Session("555", "k5", "ws://bms:1", transport=transport)
+            await session.connect()
+            item = await asyncio.wait_for(session.incoming.get(), 2)
+            assert item["type"] == "session_error"
+            assert item["user_id"] == "555"
+            await asyncio.sleep(0.05)
+            assert session.incoming.empty()  # Reported once
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_session_ended_by_the_network_leaves_the_client():
+    async def scenario():
+        transport = MemoryTransport()
+
+        async def accept_then_kick(websocket, message):
+            await websocket.send(json.dumps({"type": "auth_result", "status": "Authenticated", "user_id": message["user_id"]}))
+            if message["user_id"] == "555":
+                await websocket.send(json.dumps({"type": "kick", "user_id": "555"}))
+                await websocket.close()
+
+        async with fake_bms(transport, "bms", accept_then_kick):
+            async with StationClient("ws://bms:1", transport) as client:
+                await client.open_session("1234567890", "secretkey123")
+                await client.open_session("555", "k5")
+                item = await asyncio.wait_for(client.__anext__(), 2)
+                assert item == {"type": "session_error", "user_id": "555", "error": "Kicked by the network"}
+                assert list(client.sessions) == ["1234567890"]
+
+                await client.close_session("1234567890")
+                await asyncio.sleep(0.05)
+                assert client.incoming.empty()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_rejected_reauthentication_after_handover_is_reported():
+    async def scenario():
+        transport = MemoryTransport()
+
+        async def accept_then_hand_over(websocket, message):
+            await websocket.send(json.dumps({"type": "auth_result", "status": "Authenticated", "user_id": "555"}))
+            await websocket.send(json.dumps({"type": "handover", "user_id": "555", "server_url": "ws://next:1"}))
+            await websocket.close()
+
+        async def reject(websocket, message):
+            await websocket.send(json.dumps({"type": "auth_result", "status": "Failed", "user_id": "555"}))
+
+        async with fake_bms(transport, "bms", accept_then_hand_over), fake_bms(transport, "next", reject):
+            session = Session("555", "k5", "ws://bms:1", transport=transport)
+            await session.connect()
+            item = await asyncio.wait_for(session.incoming.get(), 2)
+            assert item["type"] == "session_error"
+            assert item["error"].startswith("Handover failed")
+            await asyncio.sleep(0.05)
+            assert session.incoming.empty()
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
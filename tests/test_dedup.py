@@ -0,0 +1,49 @@
+import time
+
+from samcom.common.exchange import make_packet_id
+from samcom.msc.dedup import DuplicateFilter
+
+EPOCH = int(time.time() * 1000)
+
+
+def packet(origin, counter, epoch=EPOCH):
+    return make_packet_id(origin, epoch, counter)
+
+
+def test_repeated_packet_is_duplicate():
+    duplicates = DuplicateFilter()
+    assert not duplicates.seen(packet("555", 1), {"555"})
+    assert duplicates.seen(packet("555", 1), {"555"})
+    assert not duplicates.seen(packet("555", 3), {"555"})
+    assert not duplicates.seen(packet("555", 2), {"555"})
+    assert duplicates.seen(packet("555", 2), {"555"})
+
+
+def test_foreign_origin_cannot_poison_window():
+    duplicates = DuplicateFilter()
+    # A text from user 555 claiming to be a BMS1 packet is not tracked
+    assert not duplicates.seen(packet("BMS1", 1, EPOCH + 10 ** 6), {"555"})
+    assert not duplicates.seen(packet("BMS1", 1), {"BMS1"})
+    assert not duplicates.seen(packet("BMS1", 2), {"BMS1"})
+
+
+def test_future_epoch_is_not_recorded():
+    duplicates = DuplicateFilter()
+    assert not duplicates.seen(packet("555", 1), {"555"})
+    assert not duplicates.seen(packet("555", 1, EPOCH + 10 ** 9), {"555"})
+    assert not duplicates.seen(packet("555", 2), {"555"})
+    assert duplicates.seen(packet("555", 2), {"555"})
+
+
+def test_reordered_packets_beyond_window_are_delivered():
+    # The uplink sends a logout ahead of 2000 queued texts from the same user
+    duplicates = DuplicateFilter()
+    assert not duplicates.seen(packet("555", 2001), {"555"})
+    dropped = sum(duplicates.seen(packet("555", counter), {"555"}) for counter in range(1, 2001))
+    assert dropped == 0
+
+
+def test_packets_from_previous_epoch_are_delivered():
+    duplicates = DuplicateFilter()
+    assert not duplicates.seen(packet("555", 1, EPOCH + 1), {"555"})
+    assert not duplicates.seen(packet("555", 5, EPOCH), {"555"})
@@ -0,0 +1,15 @@
+from samcom.common.exchange import generate_resume_token, verify_resume_token, resume_token_generation
+
+
+def test_resume_token_round_trip():
+    token = generate_resume_token("1234567890", "key", 60, generation=3)
+    assert verify_resume_token(token, "1234567890", "key")
+    assert resume_token_generation(token) == 3
+
+
+def test_resume_token_rejects_other_user_key_or_expiry():
+    token = generate_resume_token("1234567890", "key", 60)
+    assert not verify_resume_token(token, "555", "key")
+    assert not verify_resume_token(token, "1234567890", "other")
+    assert not verify_resume_token(generate_resume_token("1234567890", "key", -1), "1234567890", "key")
+    assert not verify_resume_token("garbage", "1234567890", "key")
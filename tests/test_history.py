@@ -0,0 +1,41 @@
+from samcom.user_station.history import MessageHistory
+
+
+def test_pages_walk_back_through_one_peer():
+    history = MessageHistory()
+    ids = [history.append("555", f"msg {n}") for n in range(250)]
+    history.append("777", "other conversation")
+
+    newest = history.page("555", limit=100)
+    assert [text for _, text in newest] == [f"msg {n}" for n in range(150, 250)]
+
+    older = history.page("555", before_id=newest[0][0], limit=100)
+    assert [row_id for row_id, _ in older] == ids[50:150]
+
+    oldest = history.page("555", before_id=older[0][0], limit=100)
+    assert [row_id for row_id, _ in oldest] == ids[:50]
+    assert history.page("555", before_id=oldest[0][0]) == []
+
+
+def test_peers_keep_the_order_they_were_added():
+    history = MessageHistory()
+    history.add_peer("777")
+    history.append("555", "hello")
+    history.add_peer("777")
+    history.add_peer("333")
+    assert history.peers() == ["777", "555", "333"]
+    assert history.page("333") == []
+
+
+def test_history_survives_reopening(tmp_path):
+    path = str(tmp_path / "history.db")
+    history = MessageHistory(path)
+    history.add_peer("777")
+    first = history.append("555", "kept")
+    history.close()
+
+    history = MessageHistory(path)
+    assert history.peers() == ["777", "555"]
+    assert history.page("555") == [(first, "kept")]
+    assert history.append("555", "later") > first
+    history.close()
@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from samcom.common.exchange import generate_resume_token
+from samcom.msc.core import BMSConnectionManager, MessageRouter, UserManager
+
+
+def test_late_logout_from_previous_bms_keeps_new_location():
+    user_manager = UserManager()
+    token = user_manager.issue_resume_token("1234567890")
+    user_manager.attach_user("1234567890", "BMS1", token)
+    user_manager.attach_user("1234567890", "BMS2", token)
+
+    assert not user_manager.logout_user("1234567890", "BMS1")
+    assert user_manager.get_user_location("1234567890") == "BMS2"
+    assert user_manager.get_user_status("1234567890")
+
+
+def test_logout_from_current_bms_clears_location():
+    user_manager = UserManager()
+    user_manager.attach_user("1234567890", "BMS1", user_manager.issue_resume_token("1234567890"))
+
+    assert user_manager.logout_user("1234567890", "BMS1")
+    assert user_manager.get_user_location("1234567890") is None
+    assert not user_manager.get_user_status("1234567890")
+
+
+def test_revoked_resume_token_cannot_attach():
+    user_manager = UserManager()
+    token = user_manager.issue_resume_token("1234567890")
+    assert user_manager.attach_user("1234567890", "BMS1", token)
+
+    user_manager.revoke_resume_tokens("1234567890")
+    user_manager.logout_user("1234567890")
+    assert not user_manager.attach_user("1234567890", "BMS1", token)
+    assert not user_manager.get_user_status("1234567890")
+    assert user_manager.attach_user("1234567890", "BMS1", user_manager.issue_resume_token("1234567890"))
+
+
+def test_forged_or_expired_resume_token_cannot_attach():
+    user_manager = UserManager()
+    user_manager.attach_user("1234567890", "BMS1", user_manager.issue_resume_token("1234567890"))
+
+    forged = [
+        None,
+        "x:0:0:x",
+        generate_resume_token("1234567890", "not-the-msc-key", 3600),
+        generate_resume_token("0987654321", user_manager.resume_key, 3600),
+        generate_resume_token("1234567890", user_manager.resume_key, -1),
+    ]
+    for token in forged:
+        assert not user_manager.attach_user("1234567890", "evil", token)
+    assert user_manager.get_user_location("1234567890") == "BMS1"
+
+
+class RecordingWebsocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, message):
+        self.sent.append(json.loads(message))
+
+
+def test_invalid_bms_id_does_not_block_later_registrations():
+    bms_manager = BMSConnectionManager()
+    router = MessageRouter(UserManager(), bms_manager)
+    websocket = RecordingWebsocket()
+
+    async def register(bms_id):
+        message = {"type": "bms_register", "packet_id": f"x:1:{len(websocket.sent)}"}
+        if bms_id is not None:
+            message["bms_id"] = bms_id
+        await router.handle_message(websocket, json.dumps(message))
+
+    async def scenario():
+        await register(None)
+        await register(7)
+        await register("B1")
+
+    asyncio.run(scenario())
+    assert [reply["status"] for reply in websocket.sent] == ["Failed", "Failed", "Registered"]
+    assert list(bms_manager.bms_connections) == ["B1"]
@@ -0,0 +1,82 @@
+import queue
+import time
+
+import pytest
+
+from samcom.bms.scheduler import UplinkScheduler
+
+
+def text(user_id, message="x" * 100):
+    return {"type": "text", "source_user": user_id, "target_user": "0", "message": message}
+
+
+def test_auth_is_dequeued_ahead_of_text_flood():
+    uplink = UplinkScheduler()
+    for _ in range(100000):
+        uplink.put(text("flooder"))
+    uplink.put({"type": "auth", "user_id": "555"})
+    uplink.put({"type": "auth_response", "user_id": "556"})
+
+    assert uplink.get()["type"] == "auth"
+    assert uplink.get()["type"] == "auth_response"
+
+
+def test_auth_latency_is_flat_during_flood():
+    def auth_latency(backlog):
+        uplink = UplinkScheduler()
+        for _ in range(backlog):
+            uplink.put(text("flooder"))
+        uplink.put({"type": "auth", "user_id": "555"})
+        start = time.perf_counter()
+        dequeued = 0
+        while uplink.get()["type"] != "auth":
+            dequeued += 1
+        return dequeued, time.perf_counter() - start
+
+    assert auth_latency(10)[0] == 0
+    dequeued, elapsed = auth_latency(100000)
+    assert dequeued == 0
+    assert elapsed < 0.01
+
+
+def test_users_are_served_round_robin():
+    uplink = UplinkScheduler()
+    for _ in range(1000):
+        uplink.put(text("flooder"))
+    for user_id in ("a", "b"):
+        for _ in range(3):
+            uplink.put(text(user_id))
+
+    served = [uplink.get()["source_user"] for _ in range(30)]
+    # The quiet users are finished within the first few turns, not after the flood
+    assert served.count("a") == 3
+    assert served.count("b") == 3
+    assert served.count("flooder") == 24
+
+
+def test_bandwidth_is_shared_by_bytes():
+    uplink = UplinkScheduler()
+    for _ in range(100):
+        uplink.put(text("big", "x" * 900))
+        for _ in range(10):
+            uplink.put(text("small", "x" * 36))
+
+    served = [uplink.get() for _ in range(100)]
+    big_bytes = sum(len(m["message"]) + 64 for m in served if m["source_user"] == "big")
+    small_bytes = sum(len(m["message"]) + 64 for m in served if m["source_user"] == "small")
+    assert abs(big_bytes - small_bytes) <= 2 * UplinkScheduler.QUANTUM
+
+
+def test_behaves_like_a_queue():
+    uplink = UplinkScheduler()
+    assert uplink.empty()
+    with pytest.raises(queue.Empty):
+        uplink.get_nowait()
+    with pytest.raises(queue.Empty):
+        uplink.get(timeout=0.01)
+
+    uplink.put(text("a", "1"))
+    uplink.put(text("a", "2"))
+    assert uplink.qsize() == 2
+    assert [uplink.get()["message"], uplink.get()["message"]] == ["1", "2"]
+    assert uplink.empty()
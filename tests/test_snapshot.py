@@ -0,0 +1,89 @@
+import asyncio
+import json
+import os
+import time
+
+from samcom.common.admin import IndexedDict, paginate
+from samcom.common.exchange import generate_challenge
+from samcom.common.transport import MemoryTransport
+from samcom.msc import core as msc
+
+
+def log_in(user_manager, user_id, bms_id):
+    secret_key = user_manager.users[user_id]["secret_key"]
+    assert user_manager.authenticate_user(user_id, generate_challenge(user_id, secret_key), secret_key, bms_id)
+
+
+def test_snapshot_round_trip(fresh_msc, restart_msc, tmp_path):
+    path = str(tmp_path / "state" / "msc-snapshot.json")
+    log_in(fresh_msc.user_manager, "1234567890", "B1")
+    log_in(fresh_msc.user_manager, "555", "B2")
+    resume_key = fresh_msc.user_manager.resume_key
+    fresh_msc.save_snapshot(path)
+
+    user_manager = restart_msc()
+    assert msc.load_snapshot(path)
+    assert user_manager.resume_key == resume_key
+    assert user_manager.get_user_location("555") == "B2"
+    assert isinstance(user_manager.authenticated, IndexedDict)
+    assert paginate(user_manager.authenticated)["items"] == ["1234567890", "555"]
+
+
+def test_stale_or_missing_snapshot_is_ignored(fresh_msc, restart_msc, tmp_path):
+    path = tmp_path / "msc-snapshot.json"
+    assert not msc.load_snapshot(str(path))
+
+    log_in(fresh_msc.user_manager, "555", "B2")
+    msc.save_snapshot(str(path))
+    data = json.loads(path.read_text())
+    data["saved_at"] = time.time() - msc.SNAPSHOT_MAX_AGE - 1
+    path.write_text(json.dumps(data))
+
+    user_manager = restart_msc()
+    assert not msc.load_snapshot(str(path))
+    assert user_manager.get_user_location("555") is None
+
+    path.write_text("{not json")
+    assert not msc.load_snapshot(str(path))
+
+
+def test_restarted_msc_routes_with_restored_locations(fresh_msc, restart_msc, tmp_path):
+    path = str(tmp_path / "msc-snapshot.json")
+    admin_socket = str(tmp_path / "admin.sock")
+    log_in(fresh_msc.user_manager, "1234567890", "B1")
+    log_in(fresh_msc.user_manager, "555", "B2")
+
+    async def register(transport, bms_id):
+        while "msc:1" not in transport.servers:
+            await asyncio.sleep(0.01)
+        websocket = await transport.connect("ws://msc:1")
+        await websocket.send(json.dumps({"type": "bms_register", "bms_id": bms_id, "packet_id": f"{bms_id}:1:1"}))
+        assert json.loads(await websocket.recv())["status"] == "Registered"
+        return websocket
+
+    async def scenario():
+        transport = MemoryTransport()
+        stop = asyncio.get_running_loop().create_future()
+        first = asyncio.create_task(msc.start_server("msc", 1, admin_socket, path, transport, stop))
+        b1 = await register(transport, "B1")
+        stop.set_result("restart")
+        await asyncio.wait_for(first, 5)
+        assert not os.path.exists(admin_socket)
+        await b1.close()
+
+        restart_msc()
+        stop = asyncio.get_running_loop().create_future()
+        second = asyncio.create_task(msc.start_server("msc", 1, snapshot_path=path, transport=transport, stop=stop))
+        b1 = await register(transport, "B1")
+        b2 = await register(transport, "B2")
+        await b1.send(json.dumps({
+            "type": "text", "source_user": "1234567890", "target_user": "555",
+            "message": "after restart", "packet_id": "1234567890:1:1", "bms_id": "B1"
+        }))
+        delivered = json.loads(await asyncio.wait_for(b2.recv(), 5))
+        assert delivered["message"] == "after restart"
+
+        stop.set_result("shutdown")
+        await asyncio.wait_for(second, 5)
+
+    asyncio.run(asyncio.wait_for(scenario(), 10))
@@ -0,0 +1,100 @@
+import asyncio
+
+from samcom.bms.core import BaseMessageStation
+from samcom.common.transport import MemoryTransport
+from samcom.user_station.client import StationClient
+
+
+async def wait_until(condition, timeout=5):
+    for _ in range(int(timeout / 0.01)):
+        if condition():
+            return
+        await asyncio.sleep(0.01)
+    raise AssertionError("Timed out waiting for the topology")
+
+
+class Topology:
+    """ An MSC and BMSes sharing one MemoryTransport, started on the running loop. """
+
+    def __init__(self, msc_module, names):
+        self.msc = msc_module
+        self.transport = MemoryTransport()
+        self.stop = asyncio.get_running_loop().create_future()
+        self.msc_task = asyncio.create_task(msc_module.start_server("msc", 1, transport=self.transport, stop=self.stop))
+        self.stations = [BaseMessageStation(name, 1, "ws://msc:1", name, self.transport) for name in names]
+        self.bms_tasks = [asyncio.create_task(station.start_server()) for station in self.stations]
+
+    async def ready(self):
+        await wait_until(lambda: len(self.msc.bms_manager.bms_connections) == len(self.stations))
+
+    async def shut_down(self):
+        self.stop.set_result("shutdown")
+        await asyncio.wait_for(self.msc_task, 5)
+        for station, task in zip(self.stations, self.bms_tasks):
+            station.running = False
+            station.msc_connection.running = False
+            task.cancel()
+        await asyncio.gather(*self.bms_tasks, return_exceptions=True)
+
+
+def test_text_between_users_on_one_bms_is_switched_locally(fresh_msc, monkeypatch):
+    routed, records = [], []
+    router = fresh_msc.message_router
+
+    async def record_text(msg):
+        routed.append(msg)
+
+    async def record_text_record(msg):
+        records.append(msg)
+
+    monkeypatch.setattr(router, "process_text_message", record_text)
+    monkeypatch.setattr(router, "process_text_record", record_text_record)
+
+    async def scenario():
+        topology = Topology(fresh_msc, ["B1"])
+        await topology.ready()
+        station = topology.stations[0]
+
+        async with StationClient("ws://B1:1", topology.transport) as client:
+            await client.open_session("1234567890", "secretkey123")
+            await client.open_session("555", "k5")
+            await wait_until(lambda: {"1234567890", "555"} <= station.local_subscribers)
+
+            await client.send_text("1234567890", "555", "next door")
+            message = await asyncio.wait_for(client.__anext__(), 5)
+            assert message["target_user"] == "555"
+            assert message["message"] == "next door"
+            await wait_until(lambda: records)
+
+        await topology.shut_down()
+
+    asyncio.run(asyncio.wait_for(scenario(), 20))
+    assert routed == []
+    assert len(records) == 1
+    assert records[0]["source_user"] == "1234567890"
+    assert records[0]["length"] == len("next door")
+
+
+def test_text_between_users_on_different_bms(fresh_msc):
+    async def scenario():
+        topology = Topology(fresh_msc, ["B1", "B2"])
+        await topology.ready()
+        user_manager = fresh_msc.user_manager
+
+        async with StationClient("ws://B1:1", topology.transport) as client:
+            await client.open_session("1234567890", "secretkey123")
+            await client.open_session("555", "k5", "ws://B2:1")
+            assert user_manager.get_user_location("1234567890") == "B1"
+            assert user_manager.get_user_location("555") == "B2"
+
+            await client.send_text("1234567890", "555", "hello")
+            message = await asyncio.wait_for(client.__anext__(), 5)
+            assert message["source_user"] == "1234567890"
+            assert message["target_user"] == "555"
+            assert message["message"] == "hello"
+
+        # Draining the MSC closes its connections and waits for their handlers
+        await topology.shut_down()
+        assert "msc:1" not in topology.transport.servers
+
+    asyncio.run(asyncio.wait_for(scenario(), 20))
@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from samcom.common.transport import CONNECTION_CLOSED, MemoryTransport
+
+
+def test_finished_connections_are_forgotten():
+    async def scenario():
+        transport = MemoryTransport()
+
+        async def echo(websocket, path):
+            async for message in websocket:
+                await websocket.send(message)
+
+        async with transport.serve(echo, "echo", 1) as server:
+            for i in range(50):
+                async with transport.connect("ws://echo:1") as websocket:
+                    await websocket.send(str(i))
+                    assert await websocket.recv() == str(i)
+            for _ in range(100):
+                if not server.handlers:
+                    break
+                await asyncio.sleep(0.01)
+            assert not server.handlers
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_wait_closed_waits_for_handlers():
+    async def scenario():
+        transport = MemoryTransport()
+        finished = []
+
+        async def slow_cleanup(websocket, path):
+            async for _ in websocket:
+                pass
+            await asyncio.sleep(0.05)
+            finished.append(path)
+
+        server = await transport.serve(slow_cleanup, "slow", 1)
+        websocket = await transport.connect("ws://slow:1/a")
+        await websocket.send("hello")
+        server.close()
+        await server.wait_closed()
+        assert finished == ["/a"]
+        assert "slow:1" not in transport.servers
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
+
+
+def test_send_to_closed_peer_raises():
+    async def scenario():
+        transport = MemoryTransport()
+
+        async def hang_up(websocket, path):
+            await websocket.close()
+
+        async with transport.serve(hang_up, "rude", 1):
+            websocket = await transport.connect("ws://rude:1")
+            with pytest.raises(CONNECTION_CLOSED):
+                for _ in range(100):
+                    await websocket.send("hello")
+                    await asyncio.sleep(0.01)
+
+    asyncio.run(asyncio.wait_for(scenario(), 5))
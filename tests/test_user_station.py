@@ -0,0 +1,57 @@
+import threading
+import time
+
+from samcom.user_station.core import StationInterface
+
+
+class HeadlessInterface(StationInterface):
+    """ Stands in for the Tk event loop: wakeup() signals a consumer thread. """
+
+    def __init__(self):
+        super().__init__()
+        self.username = "1234567890"
+        self.history_path = ":memory:"
+        self.event = threading.Event()
+        self.wakeups = 0
+
+    def wakeup(self):
+        self.wakeups += 1
+        self.event.set()
+
+
+def drain_until(interface, count, timeout=30):
+    processed = 0
+    deadline = time.monotonic() + timeout
+    while processed < count and time.monotonic() < deadline:
+        if interface.incoming_queue.empty():
+            interface.event.wait(0.1)
+            interface.event.clear()
+        processed += interface.process_ui_queue()
+    return processed
+
+
+def test_burst_reaches_interface_quickly():
+    interface = HeadlessInterface()
+    count = 20000
+
+    def produce():
+        for n in range(count):
+            interface.post({"action": "message", "source_user": "555", "message": str(n)})
+
+    threading.Thread(target=produce).start()
+    # The deadline is generous for loaded machines, yet the old
+    # one-item-per-100ms tick would need over half an hour for this burst
+    processed = drain_until(interface, count, timeout=30)
+    assert processed == count
+    assert len(interface.history.page("555", limit=count)) == count
+
+
+def test_wakeup_only_when_queue_becomes_non_empty():
+    interface = HeadlessInterface()
+    for n in range(100):
+        interface.post({"action": "message", "source_user": "555", "message": str(n)})
+    assert interface.wakeups == 1
+
+    assert interface.process_ui_queue() == 100
+    interface.post({"action": "message", "source_user": "555", "message": "again"})
+    assert interface.wakeups == 2